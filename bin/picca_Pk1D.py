@@ -2,7 +2,8 @@
 """Compute the 1D power spectrum
 """
 import argparse
-import glob
+import multiprocessing
+import os
 from array import array
 import numpy as np
 import fitsio
@@ -132,23 +133,272 @@ def compute_mean_delta(log_lambda, delta, ivar, z_qso, hist_delta,
             function of observed lambda
     """
 
+    lambda_ = np.power(10., log_lambda)
+    lambda_rf = lambda_ / (1. + z_qso)
+    snr_pixel = (delta + 1) * np.sqrt(ivar)
     for index, _ in enumerate(log_lambda):
-        lambda_ = np.power(10., log_lambda[index])
-        lambda_rf = lambda_ / (1. + z_qso)
-        hist_delta.Fill(lambda_, lambda_rf, delta[index])
-        hist_delta_rest_frame.Fill(lambda_rf, delta[index])
-        hist_delta_obs_frame.Fill(lambda_, delta[index])
+        hist_delta.Fill(lambda_[index], lambda_rf[index], delta[index])
+        hist_delta_rest_frame.Fill(lambda_rf[index], delta[index])
+        hist_delta_obs_frame.Fill(lambda_[index], delta[index])
         hist_ivar.Fill(ivar[index])
-        snr_pixel = (delta[index] + 1) * np.sqrt(ivar[index])
-        hist_snr.Fill(snr_pixel)
+        hist_snr.Fill(snr_pixel[index])
         hist_ivar.Fill(ivar[index])
         if ivar[index] < 1000:
-            hist_weighted_delta_rest_frame.Fill(lambda_rf, delta[index],
+            hist_weighted_delta_rest_frame.Fill(lambda_rf[index], delta[index],
                                                 ivar[index])
-            hist_weighted_delta_obs_frame.Fill(lambda_, delta[index],
+            hist_weighted_delta_obs_frame.Fill(lambda_[index], delta[index],
                                                ivar[index])
 
 
+def read_deltas(file, in_format):
+    """Reads the deltas in a file
+
+    Deltas are read one at a time, so that only one of them is kept in memory
+
+    Args:
+        file: str
+            Name of the file
+        in_format: str
+            Format of the file: fits or ascii
+
+    Yields:
+        The Delta instances in the file
+    """
+    if in_format == 'fits':
+        with fitsio.FITS(file) as hdul:
+            for hdu in hdul[1:]:
+                yield Delta.from_fitsio(hdu, pk1d_type=True)
+    elif in_format == 'ascii':
+        with open(file, 'r') as ascii_file:
+            for line in ascii_file:
+                yield Delta.from_ascii(line)
+
+
+def compute_pk1d(delta, args):
+    """Computes the 1D power spectrum of the parts of a forest
+
+    Args:
+        delta: Delta
+            The delta field of the forest
+        args: argparse.Namespace
+            The command line arguments
+
+    Returns:
+        A list with a dictionary for each of the parts of the forest passing
+        the selection cuts. The dictionaries contain the mean redshift of the
+        part ("mean_z"), the number of masked pixels ("num_masked_pixels"),
+        the filled log_lambda, delta and ivar arrays ("log_lambda", "delta",
+        "ivar") and the power spectra ("k", "pk_raw", "pk_noise", "pk_diff",
+        "correction_reso", "pk")
+    """
+    parts = []
+
+    # Selection over the SNR and the resolution
+    if (delta.mean_snr <= args.SNR_min or delta.mean_reso >= args.reso_max):
+        return parts
+
+    # first pixel in forest (log_lambda is sorted)
+    first_pixel_index = np.searchsorted(10**delta.log_lambda,
+                                        args.lambda_obs_min,
+                                        side='right')
+
+    # minimum number of pixel in forest
+    min_num_pixels = args.nb_pixel_min
+    if (len(delta.log_lambda) - first_pixel_index) < min_num_pixels:
+        return parts
+
+    # Split in n parts the forest
+    max_num_parts = ((len(delta.log_lambda) - first_pixel_index) //
+                     min_num_pixels)
+    num_parts = min(args.nb_part, max_num_parts)
+    (mean_z_array, log_lambda_array, delta_array, exposures_diff_array,
+     ivar_array) = split_forest(num_parts, delta.delta_log_lambda,
+                                delta.log_lambda, delta.delta,
+                                delta.exposures_diff, delta.ivar,
+                                first_pixel_index)
+
+    # these only depend on the forest, not on the part
+    run_noise = args.noise_estimate == 'pipeline'
+    delta_pixel = (delta.delta_log_lambda * np.log(10.) *
+                   constants.speed_light / 1000.)
+
+    for index in range(num_parts):
+
+        # rebin exposures_diff spectrum
+        if (args.noise_estimate == 'rebin_diff' or
+                args.noise_estimate == 'mean_rebin_diff'):
+            exposures_diff_array[index] = rebin_diff_noise(
+                delta.delta_log_lambda, log_lambda_array[index],
+                exposures_diff_array[index])
+
+        # Fill masked pixels with 0.
+        (log_lambda_new, delta_new, exposures_diff_new, ivar_new,
+         num_masked_pixels) = fill_masked_pixels(delta.delta_log_lambda,
+                                                 log_lambda_array[index],
+                                                 delta_array[index],
+                                                 exposures_diff_array[index],
+                                                 ivar_array[index],
+                                                 args.no_apply_filling)
+        if num_masked_pixels > args.nb_pixel_masked_max:
+            continue
+
+        # Compute pk_raw
+        k, pk_raw = compute_pk_raw(delta.delta_log_lambda, delta_new)
+
+        # Compute pk_noise
+        pk_noise, pk_diff = compute_pk_noise(delta.delta_log_lambda, ivar_new,
+                                             exposures_diff_new, run_noise)
+
+        # Compute resolution correction
+        correction_reso = compute_correction_reso(delta_pixel,
+                                                  delta.mean_reso, k)
+
+        # Compute 1D Pk
+        if args.noise_estimate == 'pipeline':
+            pk = (pk_raw - pk_noise) / correction_reso
+        elif (args.noise_estimate == 'diff' or
+              args.noise_estimate == 'rebin_diff'):
+            pk = (pk_raw - pk_diff) / correction_reso
+        elif (args.noise_estimate == 'mean_diff' or
+              args.noise_estimate == 'mean_rebin_diff'):
+            selection = (k > 0) & (k < 0.02)
+            if args.noise_estimate == 'mean_rebin_diff':
+                selection = (k > 0.003) & (k < 0.02)
+            mean_pk_diff = pk_diff[selection].mean()
+            pk = (pk_raw - mean_pk_diff) / correction_reso
+
+        parts.append({
+            "mean_z": mean_z_array[index],
+            "num_masked_pixels": num_masked_pixels,
+            "log_lambda": log_lambda_new,
+            "delta": delta_new,
+            "ivar": ivar_new,
+            "k": k,
+            "pk_raw": pk_raw,
+            "pk_noise": pk_noise,
+            "pk_diff": pk_diff,
+            "correction_reso": correction_reso,
+            "pk": pk
+        })
+
+    return parts
+
+
+def process_file(index, file, args):
+    """Computes the 1D power spectrum of the deltas in a file and saves it
+    in fits format
+
+    The random number generator is seeded with 4 plus the index of the file,
+    so that the noise realisations of a file do not depend on which process
+    handles it nor on the files processed before it.
+
+    Args:
+        index: int
+            Index of the file, used to name the output file and to seed the
+            random number generator
+        file: str
+            Name of the file
+        args: argparse.Namespace
+            The command line arguments
+
+    Returns:
+        The number of deltas read from the file
+    """
+    # initialize randoms
+    np.random.seed(4 + index)
+    num_deltas = 0
+    # the parts are buffered and written at once when the file is done
+    outputs = []
+
+    for delta in read_deltas(file, args.in_format):
+        num_deltas += 1
+        for part in compute_pk1d(delta, args):
+            header = [{
+                'name': 'RA',
+                'value': delta.ra,
+                'comment': "QSO's Right Ascension [degrees]"
+            }, {
+                'name': 'DEC',
+                'value': delta.dec,
+                'comment': "QSO's Declination [degrees]"
+            }, {
+                'name': 'Z',
+                'value': delta.z_qso,
+                'comment': "QSO's redshift"
+            }, {
+                'name': 'MEANZ',
+                'value': part["mean_z"],
+                'comment': "Absorbers mean redshift"
+            }, {
+                'name': 'MEANRESO',
+                'value': delta.mean_reso,
+                'comment': 'Mean resolution [km/s]'
+            }, {
+                'name': 'MEANSNR',
+                'value': delta.mean_snr,
+                'comment': 'Mean signal to noise ratio'
+            }, {
+                'name': 'NBMASKPIX',
+                'value': part["num_masked_pixels"],
+                'comment': 'Number of masked pixels in the section'
+            }, {
+                'name': 'PLATE',
+                'value': delta.plate,
+                'comment': "Spectrum's plate id"
+            }, {
+                'name':
+                    'MJD',
+                'value':
+                    delta.mjd,
+                'comment': ('Modified Julian Date,date the spectrum '
+                            'was taken')
+            }, {
+                'name': 'FIBER',
+                'value': delta.fiberid,
+                'comment': "Spectrum's fiber number"
+            }]
+
+            cols = [
+                part["k"], part["pk_raw"], part["pk_noise"], part["pk_diff"],
+                part["correction_reso"], part["pk"]
+            ]
+            outputs.append((header, cols))
+
+    if len(outputs) > 0:
+        names = ['k', 'Pk_raw', 'Pk_noise', 'Pk_diff', 'cor_reso', 'Pk']
+        comments = [
+            'Wavenumber', 'Raw power spectrum', "Noise's power spectrum",
+            'Noise coadd difference power spectrum',
+            'Correction resolution function',
+            'Corrected power spectrum (resolution and noise)'
+        ]
+        units = ['(km/s)^-1', 'km/s', 'km/s', 'km/s', 'km/s', 'km/s']
+        with fitsio.FITS(args.out_dir + '/Pk1D-' + str(index) + '.fits.gz',
+                         'rw',
+                         clobber=True) as results:
+            for header, cols in outputs:
+                results.write(cols,
+                              names=names,
+                              header=header,
+                              comments=comments,
+                              units=units)
+
+    return num_deltas
+
+
+def process_file_star(arguments):
+    """Unpacks the arguments of process_file (for Pool.imap_unordered)
+
+    Args:
+        arguments: tuple
+            The arguments of process_file
+
+    Returns:
+        See process_file
+    """
+    return process_file(*arguments)
+
+
 def main():
     # pylint: disable-msg=too-many-locals,too-many-branches,too-many-statements
     """Compute the 1D power spectrum"""
@@ -253,6 +503,21 @@ def main():
         help=('Name of the absorption line in picca.constants defining the '
               'redshift of the forest pixels'))
 
+    parser.add_argument(
+        '--skip-existing',
+        action='store_true',
+        default=False,
+        required=False,
+        help=('Skip the input files whose output file already exists, only '
+              'used with --out-format fits'))
+
+    parser.add_argument('--nproc',
+                        type=int,
+                        default=1,
+                        required=False,
+                        help=('Number of processors, only used with '
+                              '--out-format fits'))
+
     args = parser.parse_args()
 
     # Create root file
@@ -303,225 +568,115 @@ def main():
 
     # Read deltas
     if args.in_format == 'fits':
-        files = glob.glob(args.in_dir + "/*.fits.gz")
+        extension = ".fits.gz"
     elif args.in_format == 'ascii':
-        files = glob.glob(args.in_dir + "/*.txt")
+        extension = ".txt"
+    with os.scandir(args.in_dir) as entries:
+        files = [
+            entry.path
+            for entry in entries
+            if entry.name.endswith(extension) and entry.is_file()
+        ]
+    indexes = range(len(files))
+
+    # skip the files whose output already exists
+    if args.skip_existing and args.out_format == 'fits':
+        existing_outputs = set(os.listdir(args.out_dir))
+        indexes = [
+            index for index in indexes
+            if 'Pk1D-{}.fits.gz'.format(index) not in existing_outputs
+        ]
+        userprint("skipping {} files with existing output".format(
+            len(files) - len(indexes)))
 
     num_data = 0
+    # print progress about 100 times
+    print_every = max(1, len(indexes) // 100)
+
+    def count_deltas(num_data_list):
+        """Sums the number of deltas read from each file, printing progress
+
+        Args:
+            num_data_list: iterable of int
+                Number of deltas read from each file
+
+        Returns:
+            The total number of deltas
+        """
+        num_data = 0
+        for index, num_deltas in enumerate(num_data_list):
+            num_data += num_deltas
+            if (index + 1) % print_every == 0 or index + 1 == len(indexes):
+                userprint("\rread {} of {} {}".format(index + 1, len(indexes),
+                                                       num_data),
+                          end="")
+        userprint("")
+        return num_data
+
+    # save in fits format, one output file per input file, use pool to
+    # parallelize
+    if args.out_format == 'fits':
+        if args.nproc > 1:
+            context = multiprocessing.get_context('fork')
+            chunksize = max(1, len(indexes) // (4 * args.nproc))
+            with context.Pool(processes=args.nproc) as pool:
+                num_data = count_deltas(
+                    pool.imap_unordered(process_file_star,
+                                        [(index, files[index], args)
+                                         for index in indexes],
+                                        chunksize=chunksize))
+        else:
+            num_data = count_deltas(
+                process_file(index, files[index], args) for index in indexes)
+
+    # save in root format
+    if args.out_format == 'root':
+        # initialize randoms
+        np.random.seed(4)
+        for index, file in enumerate(files):
+            if index % print_every == 0:
+                userprint("\rread {} of {} {}".format(index, len(files),
+                                                       num_data),
+                          end="")
+
+            for delta in read_deltas(file, args.in_format):
+                num_data += 1
+                for part in compute_pk1d(delta, args):
+                    if args.debug:
+                        compute_mean_delta(part["log_lambda"], part["delta"],
+                                           part["ivar"], delta.z_qso,
+                                           hist_delta, hist_delta_rest_frame,
+                                           hist_delta_obs_frame, hist_ivar,
+                                           hist_snr,
+                                           hist_weighted_delta_rest_frame,
+                                           hist_weighted_delta_obs_frame)
 
-    # initialize randoms
-    np.random.seed(4)
-
-    # loop over input files
-    for index, file in enumerate(files):
-        if index % 1 == 0:
-            userprint("\rread {} of {} {}".format(index, len(files), num_data),
-                      end="")
-
-        # read fits or ascii file
-        if args.in_format == 'fits':
-            hdul = fitsio.FITS(file)
-            deltas = [
-                Delta.from_fitsio(hdu, pk1d_type=True) for hdu in hdul[1:]
-            ]
-        elif args.in_format == 'ascii':
-            ascii_file = open(file, 'r')
-            deltas = [Delta.from_ascii(line) for line in ascii_file]
-
-        num_data += len(deltas)
-        userprint("\n ndata =  ", num_data)
-        results = None
-
-        # loop over deltas
-        for delta in deltas:
-
-            # Selection over the SNR and the resolution
-            if (delta.mean_snr <= args.SNR_min or
-                    delta.mean_reso >= args.reso_max):
-                continue
-
-            # first pixel in forest
-            selected_pixels = 10**delta.log_lambda > args.lambda_obs_min
-            first_pixel_index = (np.argmax(selected_pixels)
-                                 if np.any(selected_pixels) else len(selected_pixels))
-
-            # minimum number of pixel in forest
-            min_num_pixels = args.nb_pixel_min
-            if (len(delta.log_lambda) - first_pixel_index) < min_num_pixels:
-                continue
-
-            # Split in n parts the forest
-            max_num_parts = (len(delta.log_lambda) -
-                             first_pixel_index) // min_num_pixels
-            num_parts = min(args.nb_part, max_num_parts)
-            (mean_z_array, log_lambda_array, delta_array, exposures_diff_array,
-             ivar_array) = split_forest(num_parts, delta.delta_log_lambda,
-                                        delta.log_lambda, delta.delta,
-                                        delta.exposures_diff, delta.ivar,
-                                        first_pixel_index)
-            for index2 in range(num_parts):
-
-                # rebin exposures_diff spectrum
-                if (args.noise_estimate == 'rebin_diff' or
-                        args.noise_estimate == 'mean_rebin_diff'):
-                    exposures_diff_array[index2] = rebin_diff_noise(
-                        delta.delta_log_lambda, log_lambda_array[index2],
-                        exposures_diff_array[index2])
-
-                # Fill masked pixels with 0.
-                (log_lambda_new, delta_new, exposures_diff_new, ivar_new,
-                 num_masked_pixels) = fill_masked_pixels(
-                     delta.delta_log_lambda, log_lambda_array[index2],
-                     delta_array[index2], exposures_diff_array[index2],
-                     ivar_array[index2], args.no_apply_filling)
-                if num_masked_pixels > args.nb_pixel_masked_max:
-                    continue
-                if args.out_format == 'root' and args.debug:
-                    compute_mean_delta(log_lambda_new, delta_new, ivar_new,
-                                       delta.z_qso, hist_delta,
-                                       hist_delta_rest_frame,
-                                       hist_delta_obs_frame, hist_ivar,
-                                       hist_snr, hist_weighted_delta_rest_frame,
-                                       hist_weighted_delta_obs_frame)
-
-                # Compute pk_raw
-                k, pk_raw = compute_pk_raw(delta.delta_log_lambda, delta_new)
-
-                # Compute pk_noise
-                run_noise = False
-                if args.noise_estimate == 'pipeline':
-                    run_noise = True
-                pk_noise, pk_diff = compute_pk_noise(delta.delta_log_lambda,
-                                                     ivar_new,
-                                                     exposures_diff_new,
-                                                     run_noise)
-
-                # Compute resolution correction
-                delta_pixel = (delta.delta_log_lambda * np.log(10.) *
-                               constants.speed_light / 1000.)
-                correction_reso = compute_correction_reso(
-                    delta_pixel, delta.mean_reso, k)
-
-                # Compute 1D Pk
-                if args.noise_estimate == 'pipeline':
-                    pk = (pk_raw - pk_noise) / correction_reso
-                elif (args.noise_estimate == 'diff' or
-                      args.noise_estimate == 'rebin_diff'):
-                    pk = (pk_raw - pk_diff) / correction_reso
-                elif (args.noise_estimate == 'mean_diff' or
-                      args.noise_estimate == 'mean_rebin_diff'):
-                    selection = (k > 0) & (k < 0.02)
-                    if args.noise_estimate == 'mean_rebin_diff':
-                        selection = (k > 0.003) & (k < 0.02)
-                    mean_pk_diff = (sum(pk_diff[selection]) /
-                                    float(len(pk_diff[selection])))
-                    pk = (pk_raw - mean_pk_diff) / correction_reso
-
-                # save in root format
-                if args.out_format == 'root':
                     z_qso[0] = delta.z_qso
-                    mean_z[0] = mean_z_array[index2]
+                    mean_z[0] = part["mean_z"]
                     mean_reso[0] = delta.mean_reso
                     mean_snr[0] = delta.mean_snr
-                    lambda_min_tree[0] = np.power(10., log_lambda_new[0])
-                    lambda_max_tree[0] = np.power(10., log_lambda_new[-1])
-                    num_masked_pixels_tree[0] = num_masked_pixels
+                    lambda_min_tree[0] = np.power(10., part["log_lambda"][0])
+                    lambda_max_tree[0] = np.power(10., part["log_lambda"][-1])
+                    num_masked_pixels_tree[0] = part["num_masked_pixels"]
 
                     plate[0] = delta.plate
                     mjd[0] = delta.mjd
                     fiber[0] = delta.fiberid
 
-                    num_bins_tree[0] = min(len(k), max_num_bins)
+                    num_bins_tree[0] = min(len(part["k"]), max_num_bins)
                     for index3 in range(num_bins_tree[0]):
-                        k_tree[index3] = k[index3]
-                        pk_raw_tree[index3] = pk_raw[index3]
-                        pk_noise_tree[index3] = pk_noise[index3]
-                        pk_diff_tree[index3] = pk_diff[index3]
-                        pk_tree[index3] = pk[index3]
-                        correction_reso_tree[index3] = correction_reso[index3]
+                        k_tree[index3] = part["k"][index3]
+                        pk_raw_tree[index3] = part["pk_raw"][index3]
+                        pk_noise_tree[index3] = part["pk_noise"][index3]
+                        pk_diff_tree[index3] = part["pk_diff"][index3]
+                        pk_tree[index3] = part["pk"][index3]
+                        correction_reso_tree[index3] = part["correction_reso"][
+                            index3]
 
                     tree.Fill()
 
-                # save in fits format
-                if args.out_format == 'fits':
-                    header = [{
-                        'name': 'RA',
-                        'value': delta.ra,
-                        'comment': "QSO's Right Ascension [degrees]"
-                    }, {
-                        'name': 'DEC',
-                        'value': delta.dec,
-                        'comment': "QSO's Declination [degrees]"
-                    }, {
-                        'name': 'Z',
-                        'value': delta.z_qso,
-                        'comment': "QSO's redshift"
-                    }, {
-                        'name': 'MEANZ',
-                        'value': mean_z_array[index2],
-                        'comment': "Absorbers mean redshift"
-                    }, {
-                        'name': 'MEANRESO',
-                        'value': delta.mean_reso,
-                        'comment': 'Mean resolution [km/s]'
-                    }, {
-                        'name': 'MEANSNR',
-                        'value': delta.mean_snr,
-                        'comment': 'Mean signal to noise ratio'
-                    }, {
-                        'name': 'NBMASKPIX',
-                        'value': num_masked_pixels,
-                        'comment': 'Number of masked pixels in the section'
-                    }, {
-                        'name': 'PLATE',
-                        'value': delta.plate,
-                        'comment': "Spectrum's plate id"
-                    }, {
-                        'name':
-                            'MJD',
-                        'value':
-                            delta.mjd,
-                        'comment': ('Modified Julian Date,date the spectrum '
-                                    'was taken')
-                    }, {
-                        'name': 'FIBER',
-                        'value': delta.fiberid,
-                        'comment': "Spectrum's fiber number"
-                    }]
-
-                    cols = [k, pk_raw, pk_noise, pk_diff, correction_reso, pk]
-                    names = [
-                        'k', 'Pk_raw', 'Pk_noise', 'Pk_diff', 'cor_reso', 'Pk'
-                    ]
-                    comments = [
-                        'Wavenumber', 'Raw power spectrum',
-                        "Noise's power spectrum",
-                        'Noise coadd difference power spectrum',
-                        'Correction resolution function',
-                        'Corrected power spectrum (resolution and noise)'
-                    ]
-                    units = [
-                        '(km/s)^-1', 'km/s', 'km/s', 'km/s', 'km/s', 'km/s'
-                    ]
-
-                    try:
-                        results.write(cols,
-                                      names=names,
-                                      header=header,
-                                      comments=comments,
-                                      units=units)
-                    except AttributeError:
-                        results = fitsio.FITS(
-                            (args.out_dir + '/Pk1D-' + str(index) + '.fits.gz'),
-                            'rw',
-                            clobber=True)
-                        results.write(cols,
-                                      names=names,
-                                      header=header,
-                                      comment=comments,
-                                      units=units)
-        if (args.out_format == 'fits' and results is not None):
-            results.close()
+            if index % print_every == 0:
+                userprint("\n ndata =  ", num_data)
 
     # Store root file results
     if args.out_format == 'root':
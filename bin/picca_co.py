@@ -6,6 +6,7 @@ import sys
 import multiprocessing
 from multiprocessing import Pool, Lock, cpu_count, Value
 import numpy as np
+import numba
 import fitsio
 
 from picca import constants, co, io, utils
@@ -181,6 +182,14 @@ def main():
                         required=False,
                         help='Number of processors')
 
+    parser.add_argument(
+        '--nthreads',
+        type=int,
+        default=1,
+        required=False,
+        help=('Number of threads used by each processor to correlate the '
+              'neighbours of an object'))
+
     args = parser.parse_args()
 
     if args.nproc is None:
@@ -195,6 +204,13 @@ def main():
     co.num_bins_r_par = args.np
     co.num_bins_r_trans = args.nt
     co.nside = args.nside
+    if args.nthreads > numba.config.NUMBA_NUM_THREADS:
+        userprint(("WARNING: --nthreads {} is larger than the {} threads "
+                   "available to numba, using {}").format(
+                       args.nthreads, numba.config.NUMBA_NUM_THREADS,
+                       numba.config.NUMBA_NUM_THREADS))
+        args.nthreads = numba.config.NUMBA_NUM_THREADS
+    co.num_threads = args.nthreads
     co.type_corr = args.type_corr
     if co.type_corr not in [
             'DD', 'RR', 'DR', 'RD', 'xDD', 'xRR', 'xD1R2', 'xR1D2'
@@ -101,9 +101,13 @@ def get_delta_from_forest(forest,
     else:
         mean_expected_flux_frac = forest.cont * stack_delta
     delta = forest.flux / mean_expected_flux_frac - 1.
-    var_pipe = 1. / forest.ivar / mean_expected_flux_frac**2
-    variance = eta * var_pipe + var_lss + fudge / var_pipe
-    weights = 1. / variance
+    var_pipe = 1. / forest.ivar
+    var_pipe /= mean_expected_flux_frac**2
+    # accumulate in place to avoid allocating temporaries
+    weights = eta * var_pipe
+    weights += var_lss
+    weights += fudge / var_pipe
+    np.reciprocal(weights, out=weights)
     exposures_diff = forest.exposures_diff
     if forest.exposures_diff is not None:
         exposures_diff /= mean_expected_flux_frac
@@ -523,9 +527,9 @@ def main():
         for healpix in data:
             for forest in data[healpix]:
                 if forest.thingid in absorbers:
-                    for lambda_absorber in absorbers[forest.thingid]:
-                        forest.add_absorber(lambda_absorber)
-                        num_absorbers += 1
+                    # mask all the absorbers of the forest in one selection
+                    forest.add_absorber(absorbers[forest.thingid])
+                    num_absorbers += len(absorbers[forest.thingid])
         log_file.write("Found {} absorbers in forests\n".format(num_absorbers))
 
     ### Add optical depth contribution
@@ -15,6 +15,8 @@ This module provides several functions:
     - compute_wickT45_pairs
 See the respective docstrings for more details
 """
+from itertools import compress
+
 import numpy as np
 from healpy import query_disc
 from numba import jit, int32
@@ -106,7 +108,7 @@ def fill_neighs(healpixs):
                 ]
             ang = delta.get_angle_between(neighbours)
             w = ang < ang_max
-            neighbours = np.array(neighbours)[w]
+            neighbours = compress(neighbours, w)
             if data2 is not None:
                 delta.neighbours = [
                     other_delta for other_delta in neighbours
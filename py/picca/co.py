@@ -3,13 +3,17 @@ analysis of two object catalogues
 
 This module provides several functions:
     - fill_neighs
+    - get_healpix_arrays
     - compute_xi
     - compute_xi_forest_pairs
+    - compute_xi_forest_pairs_fast
+    - compute_xi_healpix_pairs
+    - compute_xi_healpix_pairs_parallel
 See the respective docstrings for more details
 """
 import numpy as np
-from healpy import query_disc
-from numba import jit
+from healpy import query_disc, pix2vec, max_pixrad
+from numba import jit, prange, get_num_threads
 
 from picca.utils import userprint
 
@@ -20,57 +24,133 @@ r_par_max = None
 r_trans_max = None
 ang_max = None
 nside = None
+z_cut_min = None
+z_cut_max = None
 
 objs = None
 objs2 = None
+# arrays with the properties of objs and objs2, filled by get_healpix_arrays
+objs_arrays = {}
+objs2_arrays = {}
 
 type_corr = None
 x_correlation = False
 
 counter = None
+num_data = None
 lock = None
+# number of threads used by each process to correlate the objects of a
+# healpix, if larger than 1 use compute_xi_healpix_pairs_parallel
+num_threads = 1
+
+# properties of the objects used to select and correlate neighbours
+OBJS_PROPERTIES = [
+    "ra", "dec", "x_cart", "y_cart", "z_cart", "z_qso", "r_comov", "dist_m",
+    "weights"
+]
+# attributes set by fill_neighs on each object
+NEIGHBOURS_ATTRIBUTES = [
+    "neighbours_ang", "neighbours_z_qso", "neighbours_r_comov",
+    "neighbours_dist_m", "neighbours_weights"
+]
 
 
 def fill_neighs(healpixs):
     """Create and store a list of neighbours for each of the healpix.
 
-    Neighbours are added to the delta objects directly
+    Neighbours are added to the objects directly, stored as a set of arrays
+    (one per quantity needed by compute_xi) rather than as a list of objects:
+        neighbours_ang: Angular separation to the neighbours
+        neighbours_z_qso: Redshift of the neighbours
+        neighbours_r_comov: Comoving distance to the neighbours
+        neighbours_dist_m: Angular diameter distance to the neighbours
+        neighbours_weights: Weights of the neighbours
 
     Args:
         healpixs: array of ints
             List of healpix numbers
     """
+    if objs2 is not None:
+        catalogue = objs2
+        catalogue_arrays = objs2_arrays
+    else:
+        catalogue = objs
+        catalogue_arrays = objs_arrays
+    catalogue_healpixs = np.fromiter(catalogue.keys(), dtype=np.int64)
+
+    # all the objects in a healpix are within max_pixrad of its centre, so a
+    # single disc enlarged by max_pixrad contains the neighbouring healpixs of
+    # all of them. Extra neighbours are removed by the cut in ang below
+    pixel_radius = max_pixrad(nside)
     for healpix in healpixs:
+        healpix_neighbours = query_disc(nside,
+                                        pix2vec(nside, healpix),
+                                        ang_max + pixel_radius,
+                                        inclusive=True)
+        healpix_neighbours = healpix_neighbours[np.isin(
+            healpix_neighbours, catalogue_healpixs, assume_unique=True)]
+        neighbours_arrays = [
+            get_healpix_arrays(other_healpix, catalogue, catalogue_arrays)
+            for other_healpix in healpix_neighbours
+        ]
+        if len(neighbours_arrays) == 0:
+            healpix_thingid2 = np.zeros(0, dtype=np.int64)
+            healpix_properties2 = np.zeros((len(OBJS_PROPERTIES), 0))
+        else:
+            healpix_thingid2 = np.concatenate(
+                [thingid for thingid, _ in neighbours_arrays])
+            healpix_properties2 = np.concatenate(
+                [properties for _, properties in neighbours_arrays], axis=1)
+
         for obj1 in objs[healpix]:
-            healpix_neighbours = query_disc(
-                nside, [obj1.x_cart, obj1.y_cart, obj1.z_cart],
-                ang_max,
-                inclusive=True)
-            if objs2 is not None:
-                healpix_neighbours = [
-                    healpix for healpix in healpix_neighbours
-                    if healpix in objs2
-                ]
-                neighbours = [
-                    obj2 for healpix in healpix_neighbours
-                    for obj2 in objs2[healpix] if obj1.thingid != obj2.thingid
-                ]
-            else:
-                healpix_neighbours = [
-                    healpix for healpix in healpix_neighbours if healpix in objs
-                ]
-                neighbours = [
-                    obj2 for healpix in healpix_neighbours
-                    for obj2 in objs[healpix] if obj1.thingid != obj2.thingid
-                ]
-            ang = obj1.get_angle_between(neighbours)
-            w = ang < ang_max
-            neighbours = np.array(neighbours)[w]
-            obj1.neighbours = np.array([
-                obj2 for obj2 in neighbours
-                if ((obj2.z_qso + obj1.z_qso) / 2. >= z_cut_min and
-                    (obj2.z_qso + obj1.z_qso) / 2. < z_cut_max)
-            ])
+            properties2 = healpix_properties2[:,
+                                              healpix_thingid2 != obj1.thingid]
+            (ra2, dec2, x_cart2, y_cart2, z_cart2, z_qso2, r_comov2, dist_m2,
+             weights2) = properties2
+
+            ang = obj1.get_angle_between_arrays(x_cart2, y_cart2, z_cart2, ra2,
+                                                dec2)
+            mean_z = (z_qso2 + obj1.z_qso) / 2.
+            w = (ang < ang_max) & (mean_z >= z_cut_min) & (mean_z < z_cut_max)
+
+            obj1.neighbours_ang = ang[w]
+            obj1.neighbours_z_qso = z_qso2[w]
+            obj1.neighbours_r_comov = r_comov2[w]
+            obj1.neighbours_dist_m = dist_m2[w]
+            obj1.neighbours_weights = weights2[w]
+
+
+def get_healpix_arrays(healpix, catalogue, catalogue_arrays):
+    """Gets the properties of the objects in a healpix as arrays.
+
+    Arrays are built the first time a healpix is requested and kept in
+    catalogue_arrays for later calls.
+
+    Args:
+        healpix: int
+            Healpix number
+        catalogue: dict
+            The objects catalogue. Keys are the healpix numbers and values are
+            lists of QSO instances.
+        catalogue_arrays: dict
+            Cache with the arrays already built for this catalogue
+
+    Returns:
+        The following variables:
+            thingid: Array with the thingids of the objects
+            properties: 2D array with one row per entry in OBJS_PROPERTIES
+                and one column per object
+    """
+    if healpix not in catalogue_arrays:
+        thingid = np.array([obj.thingid for obj in catalogue[healpix]],
+                           dtype=np.int64)
+        properties = np.array(
+            [[getattr(obj, property_name)
+              for obj in catalogue[healpix]]
+             for property_name in OBJS_PROPERTIES],
+            dtype=np.float64)
+        catalogue_arrays[healpix] = (thingid, properties)
+    return catalogue_arrays[healpix]
 
 
 def compute_xi(healpixs):
@@ -94,35 +174,49 @@ def compute_xi(healpixs):
     z = np.zeros(num_bins_r_par * num_bins_r_trans)
     num_pairs = np.zeros(num_bins_r_par * num_bins_r_trans, dtype=np.int64)
 
+    properties_index = [
+        OBJS_PROPERTIES.index(property_name)
+        for property_name in ["z_qso", "r_comov", "dist_m", "weights"]
+    ]
     for healpix in healpixs:
-        for obj1 in objs[healpix]:
-
-            with lock:
-                xicounter = round(counter.value * 100. / num_data, 2)
-                if (counter.value % 1000 == 0):
-                    userprint(f"computing xi: {xicounter}%")
-                counter.value += 1
-
-            if obj1.neighbours.size == 0:
-                continue
-
-            ang = obj1.get_angle_between(obj1.neighbours)
-            z2 = np.array([obj2.z_qso for obj2 in obj1.neighbours])
-            r_comov2 = np.array([obj2.r_comov for obj2 in obj1.neighbours])
-            dist_m2 = np.array([obj2.dist_m for obj2 in obj1.neighbours])
-            weights2 = np.array([obj2.weights for obj2 in obj1.neighbours])
-
-            (rebin_weight, rebin_r_par, rebin_r_trans,
-             rebin_z, rebin_num_pairs) = compute_xi_forest_pairs(
-                 obj1.z_qso, obj1.r_comov, obj1.dist_m, obj1.weights, z2,
-                 r_comov2, dist_m2, weights2, ang)
-
-            weights[:len(rebin_weight)] += rebin_weight
-            r_par[:len(rebin_r_par)] += rebin_r_par
-            r_trans[:len(rebin_r_trans)] += rebin_r_trans
-            z[:len(rebin_z)] += rebin_z
-            num_pairs[:len(rebin_num_pairs)] += rebin_num_pairs
-            setattr(obj1, "neighbours", None)
+        healpix_objs = objs[healpix]
+
+        with lock:
+            xicounter = round(counter.value * 100. / num_data, 2)
+            if (counter.value // 1000 !=
+                (counter.value + len(healpix_objs)) // 1000):
+                userprint(f"computing xi: {xicounter}%")
+            counter.value += len(healpix_objs)
+
+        # pack the neighbours of all the objects in the healpix, the
+        # neighbours of object i are in [neighbours_indptr[i],
+        # neighbours_indptr[i + 1])
+        z1, r_comov1, dist_m1, weights1 = get_healpix_arrays(
+            healpix, objs, objs_arrays)[1][properties_index]
+        neighbours_indptr = np.zeros(len(healpix_objs) + 1, dtype=np.int64)
+        np.cumsum([obj1.neighbours_ang.size for obj1 in healpix_objs],
+                  out=neighbours_indptr[1:])
+        (ang, z2, r_comov2, dist_m2, weights2) = [
+            np.concatenate([getattr(obj1, attribute)
+                            for obj1 in healpix_objs])
+            for attribute in NEIGHBOURS_ATTRIBUTES
+        ]
+
+        if num_threads > 1 and z1.size > 1:
+            compute_xi_healpix_pairs_parallel(z1, r_comov1, dist_m1, weights1,
+                                              neighbours_indptr, z2, r_comov2,
+                                              dist_m2, weights2, ang,
+                                              num_threads, weights, r_par,
+                                              r_trans, z, num_pairs)
+        else:
+            compute_xi_healpix_pairs(z1, r_comov1, dist_m1, weights1,
+                                     neighbours_indptr, z2, r_comov2, dist_m2,
+                                     weights2, ang, weights, r_par, r_trans, z,
+                                     num_pairs)
+
+        for obj1 in healpix_objs:
+            for attribute in NEIGHBOURS_ATTRIBUTES:
+                setattr(obj1, attribute, None)
 
     w = weights > 0.
     r_par[w] /= weights[w]
@@ -131,7 +225,6 @@ def compute_xi(healpixs):
     return weights, r_par, r_trans, z, num_pairs
 
 
-@jit  #will be deprecated
 def compute_xi_forest_pairs_slow(z1, r_comov1, dist_m1, weights1, z2, r_comov2,
                                  dist_m2, weights2, ang):
     """Computes the contribution of a given pair of forests to the correlation
@@ -170,34 +263,44 @@ def compute_xi_forest_pairs_slow(z1, r_comov1, dist_m1, weights1, z2, r_comov2,
             rebin_num_pairs: The number of pairs of the correlation function
                 pixels properly rebinned
     """
-    r_par = (r_comov1 - r_comov2) * np.cos(ang / 2.)
+    half_ang = ang / 2.
+    r_par = (r_comov1 - r_comov2) * np.cos(half_ang)
     if not x_correlation or type_corr in ['DR', 'RD']:
         r_par = np.absolute(r_par)
-    r_trans = (dist_m1 + dist_m2) * np.sin(ang / 2.)
+    r_trans = (dist_m1 + dist_m2) * np.sin(half_ang)
     z = (z1 + z2) / 2.
     weights12 = weights1 * weights2
 
-    w = (r_par >= r_par_min) & (r_par < r_par_max) & (r_trans < r_trans_max)
-    w &= (weights12 > 0.)
+    w = np.logical_and.reduce((r_par >= r_par_min, r_par < r_par_max,
+                               r_trans < r_trans_max, weights12 > 0.))
     r_par = r_par[w]
     r_trans = r_trans[w]
     z = z[w]
     weights12 = weights12[w]
 
     bins_r_par = np.floor((r_par - r_par_min) / (r_par_max - r_par_min) *
-                          num_bins_r_par).astype(int)
-    bins_r_trans = (r_trans / r_trans_max * num_bins_r_trans).astype(int)
+                          num_bins_r_par).astype(np.int32)
+    bins_r_trans = (r_trans / r_trans_max * num_bins_r_trans).astype(np.int32)
     bins = bins_r_trans + num_bins_r_trans * bins_r_par
 
-    rebin_weight = np.bincount(bins, weights=weights12)
-    rebin_r_par = np.bincount(bins, weights=r_par * weights12)
-    rebin_r_trans = np.bincount(bins, weights=r_trans * weights12)
-    rebin_z = np.bincount(bins, weights=z * weights12)
-    rebin_num_pairs = np.bincount(bins)
+    # minlength makes the outputs span the full grid so that they can be
+    # directly added to the accumulated arrays
+    num_bins = num_bins_r_par * num_bins_r_trans
+    rebin_weight = np.bincount(bins, weights=weights12, minlength=num_bins)
+    rebin_r_par = np.bincount(bins,
+                              weights=r_par * weights12,
+                              minlength=num_bins)
+    rebin_r_trans = np.bincount(bins,
+                                weights=r_trans * weights12,
+                                minlength=num_bins)
+    rebin_z = np.bincount(bins, weights=z * weights12, minlength=num_bins)
+    rebin_num_pairs = np.bincount(bins, minlength=num_bins)
 
     return rebin_weight, rebin_r_par, rebin_r_trans, rebin_z, rebin_num_pairs
 
 
+#-- This has been superseeded by compute_xi_forest_pairs_fast
+#-- and will be deprecated
 @jit(nopython=True)
 def compute_xi_forest_pairs(z1, r_comov1, dist_m1, weights1, z2, r_comov2,
                             dist_m2, weights2, ang):
@@ -259,20 +362,237 @@ def compute_xi_forest_pairs(z1, r_comov1, dist_m1, weights1, z2, r_comov2,
         bin_r_trans = int(r_trans[ind] / r_trans_max * num_bins_r_trans)
         bins[ind] = bin_r_trans + num_bins_r_trans * bin_r_par
 
-    rebin_weight = numba_bincount(bins, weights=weights12)
-    rebin_r_par = numba_bincount(bins, weights=r_par * weights12)
-    rebin_r_trans = numba_bincount(bins, weights=r_trans * weights12)
-    rebin_z = numba_bincount(bins, weights=z * weights12)
-    rebin_num_pairs = numba_bincount_noweights(bins)
+    # all the bins are returned, so the outputs can be added directly to the
+    # correlation function arrays
+    minlength = num_bins_r_par * num_bins_r_trans
+    rebin_weight = numba_bincount(bins, weights12, minlength)
+    rebin_r_par = numba_bincount(bins, r_par * weights12, minlength)
+    rebin_r_trans = numba_bincount(bins, r_trans * weights12, minlength)
+    rebin_z = numba_bincount(bins, z * weights12, minlength)
+    rebin_num_pairs = numba_bincount_noweights(bins, minlength)
 
     return rebin_weight, rebin_r_par, rebin_r_trans, rebin_z, rebin_num_pairs
 
 
 @jit(nopython=True)
-def numba_bincount_noweights(bins):
+def compute_xi_forest_pairs_fast(z1, r_comov1, dist_m1, weights1, z2, r_comov2,
+                                 dist_m2, weights2, ang, rebin_weight,
+                                 rebin_r_par, rebin_r_trans, rebin_z,
+                                 rebin_num_pairs):
+    """Computes the contribution of a given pair of forests to the correlation
+    function. Fills rebin_* on place.
+
+    The selection and the binning are done in a single pass over the
+    neighbours, so no intermediate arrays are created.
+
+    Args:
+        z1: float
+            Redshift of object 1
+        r_comov1: float
+            Comoving distance to object 1 (in Mpc/h)
+        dist_m1: float
+            Comoving angular distance to object 1 (in Mpc/h)
+        weights1: float
+            Weight of object 1
+        z2: array of float
+            Redshift of the neighbours
+        r_comov2: array of float
+            Comoving distance to the neighbours (in Mpc/h)
+        dist_m2: array of float
+            Comoving angular distance to the neighbours (in Mpc/h)
+        weights2: array of float
+            Weights of the neighbours
+        ang: array of float
+            Angular separation between object 1 and its neighbours
+        rebin_weight: The weight of the correlation function pixels
+            properly rebinned
+        rebin_r_par: The parallel distance of the correlation function
+            pixels properly rebinned
+        rebin_r_trans: The transverse distance of the correlation function
+            pixels properly rebinned
+        rebin_z: The redshift of the correlation function pixels properly
+            rebinned
+        rebin_num_pairs: The number of pairs of the correlation function
+            pixels properly rebinned
+    """
+    absolute_r_par = not x_correlation or type_corr in ['DR', 'RD']
+    inv_bin_size_r_par = num_bins_r_par / (r_par_max - r_par_min)
+    inv_bin_size_r_trans = num_bins_r_trans / r_trans_max
+    for j in range(z2.size):
+        weights12 = weights1 * weights2[j]
+        if weights12 <= 0.:
+            continue
+
+        half_ang = ang[j] / 2.
+        r_par = (r_comov1 - r_comov2[j]) * np.cos(half_ang)
+        if absolute_r_par:
+            r_par = np.abs(r_par)
+        r_trans = (dist_m1 + dist_m2[j]) * np.sin(half_ang)
+        if (r_par < r_par_min or r_par >= r_par_max or
+                r_trans >= r_trans_max):
+            continue
+
+        bins_r_par = int((r_par - r_par_min) * inv_bin_size_r_par)
+        bins_r_trans = int(r_trans * inv_bin_size_r_trans)
+        bins = bins_r_trans + num_bins_r_trans * bins_r_par
+
+        rebin_weight[bins] += weights12
+        rebin_r_par[bins] += r_par * weights12
+        rebin_r_trans[bins] += r_trans * weights12
+        rebin_z[bins] += (z1 + z2[j]) / 2. * weights12
+        rebin_num_pairs[bins] += 1
+
+
+@jit(nopython=True)
+def compute_xi_healpix_pairs(z1, r_comov1, dist_m1, weights1,
+                             neighbours_indptr, z2, r_comov2, dist_m2, weights2,
+                             ang, rebin_weight, rebin_r_par, rebin_r_trans,
+                             rebin_z, rebin_num_pairs):
+    """Computes the contribution of all the objects in a healpix and their
+    neighbours to the correlation function. Fills rebin_* on place.
+
+    The neighbours of all the objects are packed in flat arrays: the
+    neighbours of object i are in the range
+    [neighbours_indptr[i], neighbours_indptr[i + 1]).
+
+    Args:
+        z1: array of float
+            Redshift of the objects
+        r_comov1: array of float
+            Comoving distance to the objects (in Mpc/h)
+        dist_m1: array of float
+            Comoving angular distance to the objects (in Mpc/h)
+        weights1: array of float
+            Weights of the objects
+        neighbours_indptr: array of int
+            Index of the first neighbour of each object in the neighbours
+            arrays, with a last entry equal to the total number of neighbours
+        z2: array of float
+            Redshift of the neighbours
+        r_comov2: array of float
+            Comoving distance to the neighbours (in Mpc/h)
+        dist_m2: array of float
+            Comoving angular distance to the neighbours (in Mpc/h)
+        weights2: array of float
+            Weights of the neighbours
+        ang: array of float
+            Angular separation between the objects and their neighbours
+        rebin_weight: The weight of the correlation function pixels
+            properly rebinned
+        rebin_r_par: The parallel distance of the correlation function
+            pixels properly rebinned
+        rebin_r_trans: The transverse distance of the correlation function
+            pixels properly rebinned
+        rebin_z: The redshift of the correlation function pixels properly
+            rebinned
+        rebin_num_pairs: The number of pairs of the correlation function
+            pixels properly rebinned
+    """
+    for index in range(z1.size):
+        start = neighbours_indptr[index]
+        end = neighbours_indptr[index + 1]
+        if start == end:
+            continue
+        compute_xi_forest_pairs_fast(z1[index], r_comov1[index],
+                                     dist_m1[index], weights1[index],
+                                     z2[start:end], r_comov2[start:end],
+                                     dist_m2[start:end], weights2[start:end],
+                                     ang[start:end], rebin_weight, rebin_r_par,
+                                     rebin_r_trans, rebin_z, rebin_num_pairs)
+
+
+@jit(nopython=True, parallel=True)
+def compute_xi_healpix_pairs_parallel(z1, r_comov1, dist_m1, weights1,
+                                      neighbours_indptr, z2, r_comov2, dist_m2,
+                                      weights2, ang, num_threads, rebin_weight,
+                                      rebin_r_par, rebin_r_trans, rebin_z,
+                                      rebin_num_pairs):
+    """Computes the contribution of all the objects in a healpix and their
+    neighbours to the correlation function. Fills rebin_* on place.
+
+    Same as compute_xi_healpix_pairs, but the objects are split in chunks
+    with similar numbers of neighbours, one per thread. Each chunk is
+    accumulated in its own set of bins, allocated once for the healpix, and
+    these are added to rebin_* at the end, so threads never write to the
+    same bin.
+
+    Args:
+        z1: array of float
+            Redshift of the objects
+        r_comov1: array of float
+            Comoving distance to the objects (in Mpc/h)
+        dist_m1: array of float
+            Comoving angular distance to the objects (in Mpc/h)
+        weights1: array of float
+            Weights of the objects
+        neighbours_indptr: array of int
+            Index of the first neighbour of each object in the neighbours
+            arrays, with a last entry equal to the total number of neighbours
+        z2: array of float
+            Redshift of the neighbours
+        r_comov2: array of float
+            Comoving distance to the neighbours (in Mpc/h)
+        dist_m2: array of float
+            Comoving angular distance to the neighbours (in Mpc/h)
+        weights2: array of float
+            Weights of the neighbours
+        ang: array of float
+            Angular separation between the objects and their neighbours
+        num_threads: int
+            Maximum number of threads to use. Limited to the number of
+            threads available to numba and to the number of objects
+        rebin_weight: The weight of the correlation function pixels
+            properly rebinned
+        rebin_r_par: The parallel distance of the correlation function
+            pixels properly rebinned
+        rebin_r_trans: The transverse distance of the correlation function
+            pixels properly rebinned
+        rebin_z: The redshift of the correlation function pixels properly
+            rebinned
+        rebin_num_pairs: The number of pairs of the correlation function
+            pixels properly rebinned
+    """
+    num_chunks = min(num_threads, get_num_threads(), z1.size)
+    # first object of each chunk, so that all the chunks have about the same
+    # number of neighbours
+    chunk_indptr = np.searchsorted(
+        neighbours_indptr,
+        np.linspace(0, neighbours_indptr[-1], num_chunks + 1))
+    chunk_indptr[0] = 0
+    chunk_indptr[-1] = z1.size
+    num_bins = rebin_weight.size
+    chunk_weight = np.zeros((num_chunks, num_bins))
+    chunk_r_par = np.zeros((num_chunks, num_bins))
+    chunk_r_trans = np.zeros((num_chunks, num_bins))
+    chunk_z = np.zeros((num_chunks, num_bins))
+    chunk_num_pairs = np.zeros((num_chunks, num_bins), dtype=np.int64)
+
+    for chunk in prange(num_chunks):
+        for index in range(chunk_indptr[chunk], chunk_indptr[chunk + 1]):
+            start = neighbours_indptr[index]
+            end = neighbours_indptr[index + 1]
+            if start == end:
+                continue
+            compute_xi_forest_pairs_fast(
+                z1[index], r_comov1[index], dist_m1[index], weights1[index],
+                z2[start:end], r_comov2[start:end], dist_m2[start:end],
+                weights2[start:end], ang[start:end], chunk_weight[chunk],
+                chunk_r_par[chunk], chunk_r_trans[chunk], chunk_z[chunk],
+                chunk_num_pairs[chunk])
+
+    for chunk in range(num_chunks):
+        rebin_weight += chunk_weight[chunk]
+        rebin_r_par += chunk_r_par[chunk]
+        rebin_r_trans += chunk_r_trans[chunk]
+        rebin_z += chunk_z[chunk]
+        rebin_num_pairs += chunk_num_pairs[chunk]
+
+
+@jit(nopython=True)
+def numba_bincount_noweights(bins, minlength=0):
     if len(bins) == 0:
-        return np.zeros(0, dtype=np.int64)
-    maxbins = bins.max() + 1
+        return np.zeros(minlength, dtype=np.int64)
+    maxbins = max(bins.max() + 1, minlength)
     num_bins = len(bins)
     out = np.zeros(maxbins, dtype=np.int64)
     for ind in range(num_bins):
@@ -281,10 +601,10 @@ def numba_bincount_noweights(bins):
 
 
 @jit(nopython=True)
-def numba_bincount(bins, weights):
+def numba_bincount(bins, weights, minlength=0):
     if len(bins) == 0:
-        return np.zeros(0, dtype=weights.dtype)
-    maxbins = bins.max() + 1
+        return np.zeros(minlength, dtype=weights.dtype)
+    maxbins = max(bins.max() + 1, minlength)
     num_bins = len(bins)
     out = np.zeros(maxbins, dtype=weights.dtype)
     for ind in range(num_bins):
@@ -1,15 +1,18 @@
 """This module defines data structure to deal with line of sight data.
 
 This module provides with three classes (QSO, Forest, Delta)
-to manage the line-of-sight data. 
+to manage the line-of-sight data, and the numba kernels compute_angles,
+compute_cont_chi2, compute_pixel_mask, rebin_ivar_weighted and
+compute_projection_stats used by them.
 See the respective docstrings for more details
 """
 import numpy as np
+from numba import jit
 import iminuit
 import fitsio
 
 from picca import constants
-from picca.utils import userprint, unred
+from picca.utils import userprint, apply_extinction, get_extinction_curve
 from picca.dla import DLA
 
 class QSO(object):
@@ -22,6 +25,9 @@ class QSO(object):
             Declination of the quasar (in radians).
         z_qso: float
             Redshift of the quasar.
+        log_one_plus_z_qso: float
+            Logarithm of one plus the quasar redshift, used to move
+            wavelengths to the quasar rest frame.
         plate: integer
             Plate number of the observation.
         fiberid: integer
@@ -56,6 +62,8 @@ class QSO(object):
     Methods:
         __init__: Initialize class instance.
         get_angle_between: Computes the angular separation between two quasars.
+        get_angle_between_arrays: Computes the angular separation between this
+            quasar and a set of positions.
     """
 
     def __init__(self, thingid, ra, dec, z_qso, plate, mjd, fiberid):
@@ -91,6 +99,7 @@ class QSO(object):
         self.cos_dec = np.cos(dec)
 
         self.z_qso = z_qso
+        self.log_one_plus_z_qso = np.log10(1. + z_qso)
         self.thingid = thingid
 
         # variables computed in function io.read_objects
@@ -113,32 +122,8 @@ class QSO(object):
             A float or an array (depending on input data) with the angular
             separation between this quasar and the object(s) in data.
         """
-        # case 1: data is list-like
-        try:
-            x_cart = np.array([d.x_cart for d in data])
-            y_cart = np.array([d.y_cart for d in data])
-            z_cart = np.array([d.z_cart for d in data])
-            ra = np.array([d.ra for d in data])
-            dec = np.array([d.dec for d in data])
-
-            cos = x_cart * self.x_cart + y_cart * self.y_cart + z_cart * self.z_cart
-            w = cos >= 1.
-            if w.sum() != 0:
-                userprint('WARNING: {} pairs have cos>=1.'.format(w.sum()))
-                cos[w] = 1.
-            w = cos <= -1.
-            if w.sum() != 0:
-                userprint('WARNING: {} pairs have cos<=-1.'.format(w.sum()))
-                cos[w] = -1.
-            angl = np.arccos(cos)
-
-            w = ((np.absolute(ra - self.ra) < constants.SMALL_ANGLE_CUT_OFF) &
-                 (np.absolute(dec - self.dec) < constants.SMALL_ANGLE_CUT_OFF))
-            if w.sum() != 0:
-                angl[w] = np.sqrt((dec[w] - self.dec)**2 +
-                                  (self.cos_dec * (ra[w] - self.ra))**2)
-        # case 2: data is a QSO
-        except TypeError:
+        # case 1: data is a QSO
+        if isinstance(data, QSO):
             x_cart = data.x_cart
             y_cart = data.y_cart
             z_cart = data.z_cart
@@ -157,9 +142,281 @@ class QSO(object):
                     (np.absolute(dec - self.dec) < constants.SMALL_ANGLE_CUT_OFF)):
                 angl = np.sqrt((dec - self.dec)**2 + (self.cos_dec *
                                                       (ra - self.ra))**2)
+        # case 2: data is list-like
+        else:
+            # gather all the coordinates in a single pass over data
+            coords = np.array(
+                [[d.x_cart, d.y_cart, d.z_cart, d.ra, d.dec] for d in data],
+                dtype=float).reshape(-1, 5)
+            x_cart, y_cart, z_cart, ra, dec = coords.T
+
+            angl = self.get_angle_between_arrays(x_cart, y_cart, z_cart, ra,
+                                                 dec)
+        return angl
+
+    def get_angle_between_arrays(self, x_cart, y_cart, z_cart, ra, dec):
+        """Computes the angular separation between this quasar and a set of
+        positions.
+
+        All the positions are processed at once, so callers that already
+        hold the coordinates as arrays do not need to build a list of
+        objects.
+
+        Args:
+            x_cart: array of floats
+                The x coordinates of the positions in a cartesian coordinate
+                system.
+            y_cart: array of floats
+                The y coordinates of the positions in a cartesian coordinate
+                system.
+            z_cart: array of floats
+                The z coordinates of the positions in a cartesian coordinate
+                system.
+            ra: array of floats
+                Right-ascension of the positions (in radians).
+            dec: array of floats
+                Declination of the positions (in radians).
+
+        Returns
+            An array with the angular separation between this quasar and each
+            of the positions.
+        """
+        angl, num_cos_above, num_cos_below = compute_angles(
+            self.x_cart, self.y_cart, self.z_cart, self.ra, self.dec,
+            self.cos_dec, x_cart, y_cart, z_cart, ra, dec)
+        if num_cos_above != 0:
+            userprint('WARNING: {} pairs have cos>=1.'.format(num_cos_above))
+        if num_cos_below != 0:
+            userprint('WARNING: {} pairs have cos<=-1.'.format(num_cos_below))
         return angl
 
 
+@jit(nopython=True)
+def compute_angles(x_cart1, y_cart1, z_cart1, ra1, dec1, cos_dec1, x_cart2,
+                   y_cart2, z_cart2, ra2, dec2):
+    """Computes the angular separation between a position and a set of
+    positions.
+
+    The angle is computed from the scalar product of the cartesian
+    coordinates, except for pairs closer than constants.SMALL_ANGLE_CUT_OFF
+    in both ra and dec, where the flat-sky approximation is used. Everything
+    is computed in a single pass over the positions.
+
+    Args:
+        x_cart1, y_cart1, z_cart1: float
+            Cartesian coordinates of the first position
+        ra1: float
+            Right-ascension of the first position (in radians)
+        dec1: float
+            Declination of the first position (in radians)
+        cos_dec1: float
+            Cosine of the declination of the first position
+        x_cart2, y_cart2, z_cart2: array of floats
+            Cartesian coordinates of the positions
+        ra2: array of floats
+            Right-ascension of the positions (in radians)
+        dec2: array of floats
+            Declination of the positions (in radians)
+
+    Returns:
+        The following variables:
+            angl: The angular separation to each of the positions
+            num_cos_above: Number of pairs with cos >= 1 (set to 1)
+            num_cos_below: Number of pairs with cos <= -1 (set to -1)
+    """
+    angl = np.empty(x_cart2.size)
+    num_cos_above = 0
+    num_cos_below = 0
+    for index in range(x_cart2.size):
+        cos = (x_cart2[index] * x_cart1 + y_cart2[index] * y_cart1 +
+               z_cart2[index] * z_cart1)
+        if cos >= 1.:
+            num_cos_above += 1
+            cos = 1.
+        elif cos <= -1.:
+            num_cos_below += 1
+            cos = -1.
+
+        delta_ra = ra2[index] - ra1
+        delta_dec = dec2[index] - dec1
+        if (np.absolute(delta_ra) < constants.SMALL_ANGLE_CUT_OFF and
+                np.absolute(delta_dec) < constants.SMALL_ANGLE_CUT_OFF):
+            angl[index] = np.sqrt(delta_dec**2 + (cos_dec1 * delta_ra)**2)
+        else:
+            angl[index] = np.arccos(cos)
+    return angl, num_cos_above, num_cos_below
+
+
+@jit(nopython=True)
+def compute_cont_chi2(p0, p1, log_lambda_shift, log_lambda_range, mean_cont,
+                      flux, ivar, eta, var_lss, fudge):
+    """Computes the chi2 of the continuum model of a forest.
+
+    The model is the mean continuum multiplied by a linear function of the
+    wavelength (see Forest.cont_fit). The model, the weights and the chi2
+    are computed in a single pass over the pixels.
+
+    Args:
+        p0: float
+            Zero point of the linear function (flux mean)
+        p1: float
+            Slope of the linear function (evolution of the flux)
+        log_lambda_shift: array of floats
+            Logarithm of the wavelength minus its minimum value in the forest
+        log_lambda_range: float
+            Difference between the maximum and minimum value of the logarithm
+            of the wavelength in the forest
+        mean_cont: array of floats
+            Mean continuum
+        flux: array of floats
+            Flux of the forest
+        ivar: array of floats
+            Inverse variance of the forest
+        eta: array of floats
+            Correction factor to the contribution of the pipeline estimate of
+            the instrumental noise to the variance.
+        var_lss: array of floats
+            Pixel variance due to the Large Scale Strucure
+        fudge: array of floats
+            Fudge contribution to the variance
+
+    Returns:
+        The obtained chi2
+    """
+    chi2 = 0.
+    sum_log_weights = 0.
+    for index in range(flux.size):
+        cont_model = ((p1 * log_lambda_shift[index] / log_lambda_range + p0) *
+                      mean_cont[index])
+        var_pipe = 1. / ivar[index] / cont_model**2
+        ## prep_del.variance is the variance of delta
+        ## we want here the weights = ivar(flux)
+
+        variance = (eta[index] * var_pipe + var_lss[index] +
+                    fudge[index] / var_pipe)
+        weights = 1.0 / cont_model**2 / variance
+
+        chi2 += (flux[index] - cont_model)**2 * weights
+        sum_log_weights += np.log(weights)
+    return chi2 - sum_log_weights
+
+
+@jit(nopython=True)
+def compute_pixel_mask(log_lambda, ivar, log_one_plus_z_qso, log_lambda_min,
+                       log_lambda_max, log_lambda_min_rest_frame,
+                       log_lambda_max_rest_frame):
+    """Selects the pixels of a forest within the wavelength ranges.
+
+    All the conditions are evaluated in a single pass over the pixels.
+
+    Args:
+        log_lambda: array of floats
+            Logarithm of the wavelength (in Angs)
+        ivar: array of floats
+            Inverse variance of each of the pixels
+        log_one_plus_z_qso: float
+            Logarithm of one plus the quasar redshift
+        log_lambda_min: float
+            Logarithm of the minimum wavelength (in Angs)
+        log_lambda_max: float
+            Logarithm of the maximum wavelength (in Angs)
+        log_lambda_min_rest_frame: float
+            As log_lambda_min but for rest-frame wavelength.
+        log_lambda_max_rest_frame: float
+            As log_lambda_max but for rest-frame wavelength.
+
+    Returns:
+        A boolean array, True for the pixels to keep
+    """
+    w = np.empty(log_lambda.size, dtype=np.bool_)
+    for index in range(log_lambda.size):
+        rest_frame_log_lambda = log_lambda[index] - log_one_plus_z_qso
+        w[index] = (log_lambda[index] >= log_lambda_min and
+                    log_lambda[index] < log_lambda_max and
+                    rest_frame_log_lambda > log_lambda_min_rest_frame and
+                    rest_frame_log_lambda < log_lambda_max_rest_frame and
+                    ivar[index] > 0.)
+    return w
+
+
+@jit(nopython=True)
+def rebin_ivar_weighted(bins, ivar, ivar_values, num_bins):
+    """Rebins a set of quantities using inverse variance weighting.
+
+    The inverse variance and all the quantities are accumulated in a single
+    pass over the pixels.
+
+    Args:
+        bins: array of ints
+            Bin of each of the pixels
+        ivar: array of floats
+            Inverse variance of each of the pixels
+        ivar_values: 2D array of floats
+            Quantities to rebin multiplied by ivar, one row per quantity and
+            one column per pixel. The products are left to the caller so that
+            they are computed in the precision of the input arrays.
+        num_bins: int
+            Number of bins
+
+    Returns:
+        The following variables:
+            rebin_ivar: Sum of the inverse variances in each bin
+            rebin_values: Sum of ivar_values in each bin, one row per
+                quantity. Divide by rebin_ivar to get the weighted mean.
+    """
+    rebin_ivar = np.zeros(num_bins)
+    rebin_values = np.zeros((ivar_values.shape[0], num_bins))
+    for index in range(bins.size):
+        rebin_ivar[bins[index]] += ivar[index]
+        for index2 in range(ivar_values.shape[0]):
+            rebin_values[index2, bins[index]] += ivar_values[index2, index]
+    return rebin_ivar, rebin_values
+
+
+@jit(nopython=True)
+def compute_projection_stats(log_lambda, delta, weights):
+    """Computes the weighted means needed to project a delta field.
+
+    The weighted means are accumulated in a first pass over the pixels and
+    the slope of delta with log_lambda in a second pass over the
+    mean-subtracted wavelengths.
+
+    Args:
+        log_lambda: array of floats
+            Logarithm of the wavelength (in Angs)
+        delta: array of floats
+            Mean transmission fluctuation (delta field)
+        weights: array of floats
+            Pixel weights
+
+    Returns:
+        The following variables:
+            mean_delta: Weighted mean of delta
+            mean_log_lambda: Weighted mean of log_lambda
+            mean_delta_log_lambda: Weighted slope of delta with log_lambda
+                (zero if all the pixels share the same wavelength)
+    """
+    sum_weights = 0.
+    sum_weights_delta = 0.
+    sum_weights_log_lambda = 0.
+    for index in range(delta.size):
+        sum_weights += weights[index]
+        sum_weights_delta += weights[index] * delta[index]
+        sum_weights_log_lambda += weights[index] * log_lambda[index]
+    mean_delta = sum_weights_delta / sum_weights
+    mean_log_lambda = sum_weights_log_lambda / sum_weights
+
+    numerator = 0.
+    denominator = 0.
+    for index in range(delta.size):
+        meanless_log_lambda = log_lambda[index] - mean_log_lambda
+        numerator += weights[index] * delta[index] * meanless_log_lambda
+        denominator += weights[index] * meanless_log_lambda**2
+    if denominator == 0.:
+        return mean_delta, mean_log_lambda, 0.
+    return mean_delta, mean_log_lambda, numerator / denominator
+
+
 class Forest(QSO):
     """Class to represent a Lyman alpha (or other absorption) forest
 
@@ -233,10 +490,14 @@ class Forest(QSO):
         dla_mask_limit: float
             Lower limit on the DLA transmission. Transmissions below this
             number are masked.
+        pixel_attributes: tuple of str
+            Names of the attributes holding one value per pixel. These are
+            the arrays trimmed by select_pixels.
 
     Methods:
         __init__: Initializes class instances.
-        __add__: Adds the information of another forest.
+        coadd: Coadds the information of another forest.
+        coadd_forests: Coadds a list of forests in a single rebinning.
         correct_flux: Corrects for multiplicative errors in pipeline flux
             calibration.
         correct_ivar: Corrects for multiplicative errors in pipeline inverse
@@ -256,6 +517,12 @@ class Forest(QSO):
         add_dla: Adds DLA to forest. Masks it by removing the afffected pixels.
         add_absorber: Adds absorber to forest. Masks it by removing the
             afffected pixels.
+        select_pixels: Keeps only the selected pixels in all the pixel arrays.
+        get_rebin_log_lambda: Returns the first pixels of the rebinning
+            wavelength grid.
+        get_extinction_curve: Returns the (cached) dust extinction curve.
+        get_variance_terms: Returns var_lss, eta and fudge on the wavelength
+            array.
         cont_fit: Computes the forest continuum.
     """
     log_lambda_min = None
@@ -265,6 +532,116 @@ class Forest(QSO):
     rebin = None
     delta_log_lambda = None
 
+    # names of the attributes holding one value per pixel (see select_pixels)
+    pixel_attributes = ('ivar', 'log_lambda', 'flux', 'dla_transmission',
+                        'mean_optical_depth', 'mean_expected_flux_frac',
+                        'exposures_diff', 'reso')
+
+    # cached rebinning wavelength grid (see get_rebin_log_lambda)
+    _rebin_log_lambda = None
+    _rebin_log_lambda_key = None
+
+    # cached dust extinction curve (see get_extinction_curve)
+    _extinction_log_lambda = None
+    _extinction_curve = None
+
+    # var_lss, eta and fudge tabulated on the rebinning grid
+    # (see get_variance_terms)
+    _variance_terms_key = None
+    _variance_terms_grid = None
+    _variance_terms = None
+
+    @classmethod
+    def get_rebin_log_lambda(cls, num_bins):
+        """Returns the first num_bins wavelengths of the rebinning grid.
+
+        The grid is built once for the current values of log_lambda_min,
+        log_lambda_max and delta_log_lambda and sliced afterwards. It is
+        rebuilt if any of them change.
+
+        Args:
+            num_bins: int
+                Number of pixels in the grid
+
+        Returns:
+            A view on the cached array with the logarithm of the wavelengths
+            (in Angs)
+        """
+        key = (Forest.log_lambda_min, Forest.log_lambda_max,
+               Forest.delta_log_lambda)
+        grid = Forest._rebin_log_lambda
+        if (grid is None or Forest._rebin_log_lambda_key != key or
+                grid.size < num_bins):
+            size = num_bins
+            if Forest.log_lambda_max is not None:
+                size = max(
+                    size,
+                    int(np.ceil((Forest.log_lambda_max - Forest.log_lambda_min)
+                                / Forest.delta_log_lambda)) + 2)
+            Forest._rebin_log_lambda = (Forest.log_lambda_min + np.arange(size) *
+                                        Forest.delta_log_lambda)
+            Forest._rebin_log_lambda_key = key
+        return Forest._rebin_log_lambda[:num_bins]
+
+    @classmethod
+    def get_extinction_curve(cls, log_lambda):
+        """Returns the dust extinction curve A(lambda)/E(B-V).
+
+        The curve only depends on the wavelength, so it is kept for the last
+        wavelength array seen and reused by the following forests sharing it
+        (e.g. all the spectra in a plate).
+
+        Args:
+            log_lambda: array of float
+                Array containing the logarithm of the wavelengths (in Angs)
+
+        Returns:
+            An array with the extinction curve
+        """
+        if not np.array_equal(log_lambda, Forest._extinction_log_lambda):
+            Forest._extinction_log_lambda = np.array(log_lambda)
+            Forest._extinction_curve = get_extinction_curve(10**log_lambda)
+        return Forest._extinction_curve
+
+    @classmethod
+    def get_variance_terms(cls, log_lambda):
+        """Returns var_lss, eta and fudge on the wavelength array.
+
+        The three functions only depend on the observed wavelength and the
+        pixels of the forests lie on the rebinning grid, so they are
+        tabulated on the whole grid until any of them is replaced, and the
+        values of the forest are gathered from the tables. Arrays that are
+        not on the grid are passed to the functions directly.
+
+        Args:
+            log_lambda: array of float
+                Array containing the logarithm of the wavelengths (in Angs)
+
+        Returns:
+            The arrays var_lss, eta and fudge
+        """
+        functions = (Forest.get_var_lss, Forest.get_eta, Forest.get_fudge)
+        if log_lambda.size > 0 and Forest.delta_log_lambda is not None:
+            bins = np.rint((log_lambda - Forest.log_lambda_min) /
+                           Forest.delta_log_lambda).astype(np.int32,
+                                                           copy=False)
+            if bins.min() >= 0:
+                grid = Forest.get_rebin_log_lambda(bins.max() + 1)
+                if np.array_equal(grid[bins], log_lambda):
+                    if (Forest._variance_terms_key != functions or
+                            Forest._variance_terms_grid is not
+                            Forest._rebin_log_lambda):
+                        Forest._variance_terms = [
+                            function(Forest._rebin_log_lambda)
+                            for function in functions
+                        ]
+                        Forest._variance_terms_key = functions
+                        Forest._variance_terms_grid = Forest._rebin_log_lambda
+                    return tuple(
+                        table[bins] for table in Forest._variance_terms)
+
+        return tuple(function(log_lambda) for function in functions)
+
     @classmethod
     def correct_flux(cls, log_lambda):
         """Corrects for multiplicative errors in pipeline flux calibration.
@@ -445,23 +822,21 @@ class Forest(QSO):
 
         # apply dust extinction correction
         if Forest.extinction_bv_map is not None:
-            corr = unred(10**log_lambda, Forest.extinction_bv_map[thingid])
+            corr = apply_extinction(Forest.get_extinction_curve(log_lambda),
+                                    Forest.extinction_bv_map[thingid])
             flux /= corr
             ivar *= corr**2
             if not exposures_diff is None:
                 exposures_diff /= corr
 
         ## cut to specified range
-        bins = (np.floor((log_lambda - Forest.log_lambda_min) /
-                         Forest.delta_log_lambda + 0.5).astype(int))
+        bins = np.rint((log_lambda - Forest.log_lambda_min) /
+                       Forest.delta_log_lambda).astype(np.int32, copy=False)
         log_lambda = Forest.log_lambda_min + bins * Forest.delta_log_lambda
-        w = (log_lambda >= Forest.log_lambda_min)
-        w = w & (log_lambda < Forest.log_lambda_max)
-        w = w & (log_lambda - np.log10(1. + self.z_qso) >
-                 Forest.log_lambda_min_rest_frame)
-        w = w & (log_lambda - np.log10(1. + self.z_qso) <
-                 Forest.log_lambda_max_rest_frame)
-        w = w & (ivar > 0.)
+        w = compute_pixel_mask(log_lambda, ivar, self.log_one_plus_z_qso,
+                               Forest.log_lambda_min, Forest.log_lambda_max,
+                               Forest.log_lambda_min_rest_frame,
+                               Forest.log_lambda_max_rest_frame)
         if w.sum() == 0:
             return
         bins = bins[w]
@@ -476,41 +851,31 @@ class Forest(QSO):
             reso = reso[w]
 
         # rebin arrays
-        rebin_log_lambda = (Forest.log_lambda_min +
-                            np.arange(bins.max() + 1) * Forest.delta_log_lambda)
-        rebin_flux = np.zeros(bins.max() + 1)
-        rebin_ivar = np.zeros(bins.max() + 1)
-        if mean_expected_flux_frac is not None:
-            rebin_mean_expected_flux_frac = np.zeros(bins.max() + 1)
-        rebin_flux_aux = np.bincount(bins, weights=ivar * flux)
-        rebin_ivar_aux = np.bincount(bins, weights=ivar)
+        rebin_log_lambda = Forest.get_rebin_log_lambda(bins.max() + 1)
+        # this should contain all quantities that are to be rebinned using
+        # ivar weighting
+        ivar_rebin_data = {'flux': flux}
         if mean_expected_flux_frac is not None:
-            rebin_mean_expected_flux_frac_aux = np.bincount(
-                bins, weights=ivar * mean_expected_flux_frac)
+            ivar_rebin_data['mean_expected_flux_frac'] = mean_expected_flux_frac
         if exposures_diff is not None:
-            rebin_exposures_diff = np.bincount(bins,
-                                               weights=ivar * exposures_diff)
+            ivar_rebin_data['exposures_diff'] = exposures_diff
         if reso is not None:
-            rebin_reso = np.bincount(bins, weights=ivar * reso)
-        rebin_flux[:len(rebin_flux_aux)] += rebin_flux_aux
-        rebin_ivar[:len(rebin_ivar_aux)] += rebin_ivar_aux
-        if mean_expected_flux_frac is not None:
-            rebin_mean_expected_flux_frac[:len(
-                rebin_mean_expected_flux_frac_aux
-            )] += rebin_mean_expected_flux_frac_aux
+            ivar_rebin_data['reso'] = reso
+        rebin_ivar, rebin_values = rebin_ivar_weighted(
+            bins, ivar,
+            np.array([ivar * value for value in ivar_rebin_data.values()],
+                     dtype=float), bins.max() + 1)
         w = (rebin_ivar > 0.)
         if w.sum() == 0:
             return
         log_lambda = rebin_log_lambda[w]
-        flux = rebin_flux[w] / rebin_ivar[w]
         ivar = rebin_ivar[w]
-        if mean_expected_flux_frac is not None:
-            mean_expected_flux_frac = (rebin_mean_expected_flux_frac[w] /
-                                       rebin_ivar[w])
-        if exposures_diff is not None:
-            exposures_diff = rebin_exposures_diff[w] / rebin_ivar[w]
-        if reso is not None:
-            reso = rebin_reso[w] / rebin_ivar[w]
+        ivar_rebin_data = dict(
+            zip(ivar_rebin_data.keys(), rebin_values[:, w] / ivar))
+        flux = ivar_rebin_data['flux']
+        mean_expected_flux_frac = ivar_rebin_data.get('mean_expected_flux_frac')
+        exposures_diff = ivar_rebin_data.get('exposures_diff')
+        reso = ivar_rebin_data.get('reso')
 
         # Flux calibration correction
         try:
@@ -543,9 +908,7 @@ class Forest(QSO):
         else:
             self.mean_reso = None
 
-        error = 1.0 / np.sqrt(ivar)
-        snr = flux / error
-        self.mean_snr = sum(snr) / float(len(snr))
+        self.mean_snr = (flux * np.sqrt(ivar)).mean()
         lambda_abs_igm = constants.ABSORBER_IGM[self.abs_igm]
         self.mean_z = ((np.power(10., log_lambda[len(log_lambda) - 1]) +
                         np.power(10., log_lambda[0])) / 2. / lambda_abs_igm -
@@ -572,59 +935,76 @@ class Forest(QSO):
         Returns:
             The coadded forest.
         """
-        if self.log_lambda is None or other.log_lambda is None:
-            return self
+        return Forest.coadd_forests([self, other])
+
+    @classmethod
+    def coadd_forests(cls, forests):
+        """Coadds a list of forests into the first one.
+
+        Forests are coadded by using inverse variance weighting. The pixels of
+        all the forests are concatenated once and rebinned in a single pass,
+        rather than rebinning after each pairwise coadd.
+
+        Args:
+            forests: list of Forest
+                The forests to be coadded. Forests that do not have the
+                attribute log_lambda are ignored. If the first forest does not
+                have it, then the method returns it without doing anything.
+
+        Returns:
+            The first forest, updated with the coadded information.
+        """
+        forest = forests[0]
+        others = [other for other in forests[1:] if other.log_lambda is not None]
+        if forest.log_lambda is None or len(others) == 0:
+            return forest
+        forests = [forest] + others
 
         # this should contain all quantities that are to be coadded using
         # ivar weighting
         ivar_coadd_data = {}
 
-        log_lambda = np.append(self.log_lambda, other.log_lambda)
-        ivar_coadd_data['flux'] = np.append(self.flux, other.flux)
-        ivar = np.append(self.ivar, other.ivar)
-
-        if self.mean_expected_flux_frac is not None:
-            mean_expected_flux_frac = np.append(self.mean_expected_flux_frac,
-                                                other.mean_expected_flux_frac)
-            ivar_coadd_data['mean_expected_flux_frac'] = mean_expected_flux_frac
-
-        if self.exposures_diff is not None:
-            ivar_coadd_data['exposures_diff'] = np.append(
-                self.exposures_diff, other.exposures_diff)
-        if self.reso is not None:
-            ivar_coadd_data['reso'] = np.append(self.reso, other.reso)
+        log_lambda = np.concatenate([item.log_lambda for item in forests])
+        ivar_coadd_data['flux'] = np.concatenate(
+            [item.flux for item in forests])
+        ivar = np.concatenate([item.ivar for item in forests])
+
+        if forest.mean_expected_flux_frac is not None:
+            ivar_coadd_data['mean_expected_flux_frac'] = np.concatenate(
+                [item.mean_expected_flux_frac for item in forests])
+        if forest.exposures_diff is not None:
+            ivar_coadd_data['exposures_diff'] = np.concatenate(
+                [item.exposures_diff for item in forests])
+        if forest.reso is not None:
+            ivar_coadd_data['reso'] = np.concatenate(
+                [item.reso for item in forests])
 
         # coadd the deltas by rebinning
-        bins = np.floor((log_lambda - Forest.log_lambda_min) /
-                        Forest.delta_log_lambda + 0.5).astype(int)
-        rebin_log_lambda = Forest.log_lambda_min + (np.arange(bins.max() + 1) *
-                                                    Forest.delta_log_lambda)
-        rebin_ivar = np.zeros(bins.max() + 1)
-        rebin_ivar_aux = np.bincount(bins, weights=ivar)
-        rebin_ivar[:len(rebin_ivar_aux)] += rebin_ivar_aux
-        w = (rebin_ivar > 0.)
-        self.log_lambda = rebin_log_lambda[w]
-        self.ivar = rebin_ivar[w]
-
+        bins = np.rint((log_lambda - Forest.log_lambda_min) /
+                       Forest.delta_log_lambda).astype(np.int32, copy=False)
+        rebin_log_lambda = Forest.get_rebin_log_lambda(bins.max() + 1)
         # rebin using inverse variance weighting
-        for key, value in ivar_coadd_data.items():
-            rebin_value = np.zeros(bins.max() + 1)
-            rebin_value_aux = np.bincount(bins, weights=ivar * value)
-            rebin_value[:len(rebin_value_aux)] += rebin_value_aux
-            setattr(self, key, rebin_value[w] / rebin_ivar[w])
+        rebin_ivar, rebin_values = rebin_ivar_weighted(
+            bins, ivar,
+            np.array([ivar * value for value in ivar_coadd_data.values()],
+                     dtype=float), bins.max() + 1)
+        w = (rebin_ivar > 0.)
+        forest.log_lambda = rebin_log_lambda[w]
+        forest.ivar = rebin_ivar[w]
+        for key, value in zip(ivar_coadd_data.keys(),
+                              rebin_values[:, w] / forest.ivar):
+            setattr(forest, key, value)
 
         # recompute means of quality variables
-        if self.reso is not None:
-            self.mean_reso = self.reso.mean()
-        error = 1. / np.sqrt(self.ivar)
-        snr = self.flux / error
-        self.mean_snr = snr.mean()
-        lambda_abs_igm = constants.ABSORBER_IGM[self.abs_igm]
-        self.mean_z = ((np.power(10., log_lambda[len(log_lambda) - 1]) +
-                        np.power(10., log_lambda[0])) / 2. / lambda_abs_igm -
-                       1.0)
+        if forest.reso is not None:
+            forest.mean_reso = forest.reso.mean()
+        forest.mean_snr = (forest.flux * np.sqrt(forest.ivar)).mean()
+        lambda_abs_igm = constants.ABSORBER_IGM[forest.abs_igm]
+        forest.mean_z = ((np.power(10., log_lambda[len(log_lambda) - 1]) +
+                          np.power(10., log_lambda[0])) / 2. / lambda_abs_igm -
+                         1.0)
 
-        return self
+        return forest
 
     def mask(self, mask_table):
         """Applies wavelength masking.
@@ -658,19 +1038,12 @@ class Forest(QSO):
         for mask_range in mask_obs_frame:
             w &= ((self.log_lambda < mask_range['log_wave_min']) |
                   (self.log_lambda > mask_range['log_wave_max']))
+        rest_frame_log_lambda = self.log_lambda - self.log_one_plus_z_qso
         for mask_range in mask_rest_frame:
-            rest_frame_log_lambda = self.log_lambda - np.log10(1. + self.z_qso)
             w &= ((rest_frame_log_lambda < mask_range['log_wave_min']) |
                   (rest_frame_log_lambda > mask_range['log_wave_max']))
 
-        parameters = [
-            'ivar', 'log_lambda', 'flux', 'dla_transmission',
-            'mean_optical_depth', 'mean_expected_flux_frac', 'exposures_diff',
-            'reso'
-        ]
-        for param in parameters:
-            if hasattr(self, param) and (getattr(self, param) is not None):
-                setattr(self, param, getattr(self, param)[w])
+        self.select_pixels(w)
 
         return
 
@@ -699,9 +1072,11 @@ class Forest(QSO):
         if self.mean_optical_depth is None:
             self.mean_optical_depth = np.ones(self.log_lambda.size)
 
-        w = 10.**self.log_lambda / (1. + self.z_qso) <= lambda_rest_frame
-        z = 10.**self.log_lambda / lambda_rest_frame - 1.
-        self.mean_optical_depth[w] *= np.exp(-tau * (1. + z[w])**gamma)
+        lambda_ = 10.**self.log_lambda
+        w = lambda_ / (1. + self.z_qso) <= lambda_rest_frame
+        # only evaluate the absorbed pixels
+        z = lambda_[w] / lambda_rest_frame - 1.
+        self.mean_optical_depth[w] *= np.exp(-tau * (1. + z)**gamma)
 
         return
 
@@ -732,47 +1107,57 @@ class Forest(QSO):
             select_dla_mask = mask_table['frame'] == 'RF_DLA'
             mask = mask_table[select_dla_mask]
             if len(mask)>0:
+                dla_rest_frame_log_lambda = self.log_lambda - np.log10(1. + z_abs)
                 for mask_range in mask:
-                    w &= ((self.log_lambda - np.log10(1. + z_abs) < mask_range['log_wave_min']) |
-                          (self.log_lambda - np.log10(1. + z_abs) > mask_range['log_wave_max']))
+                    w &= ((dla_rest_frame_log_lambda < mask_range['log_wave_min']) |
+                          (dla_rest_frame_log_lambda > mask_range['log_wave_max']))
 
         # do the actual masking
-        parameters = [
-            'ivar', 'log_lambda', 'flux', 'dla_transmission',
-            'mean_optical_depth', 'mean_expected_flux_frac', 'exposures_diff',
-            'reso'
-        ]
-        for param in parameters:
-            if hasattr(self, param) and (getattr(self, param) is not None):
-                setattr(self, param, getattr(self, param)[w])
+        self.select_pixels(w)
 
         return
 
     def add_absorber(self, lambda_absorber):
         """Adds absorber to forest. Masks it by removing the afffected pixels.
 
+        Several absorbers can be passed at once, in which case their masks
+        are combined and the pixels are selected only once.
+
         Args:
-            lambda_absorber: float
-                Wavelength of the absorber
+            lambda_absorber: float or array of float
+                Wavelength(s) of the absorber(s)
         """
         if self.log_lambda is None:
             return
 
         w = np.ones(self.log_lambda.size, dtype=bool)
-        w &= (np.fabs(1.e4 * (self.log_lambda - np.log10(lambda_absorber))) >
-              Forest.absorber_mask_width)
-
-        parameters = [
-            'ivar', 'log_lambda', 'flux', 'dla_transmission',
-            'mean_optical_depth', 'mean_expected_flux_frac', 'exposures_diff',
-            'reso'
-        ]
-        for param in parameters:
-            if hasattr(self, param) and (getattr(self, param) is not None):
-                setattr(self, param, getattr(self, param)[w])
+        for log_lambda_absorber in np.log10(np.atleast_1d(lambda_absorber)):
+            w &= (np.fabs(1.e4 * (self.log_lambda - log_lambda_absorber)) >
+                  Forest.absorber_mask_width)
+
+        self.select_pixels(w)
 
         return
 
+    def select_pixels(self, w):
+        """Keeps only the selected pixels in all the pixel arrays.
+
+        The boolean selection is converted to indices once and the arrays are
+        not copied if all the pixels are selected.
+
+        Args:
+            w: array of bool
+                Selection of the pixels to keep
+        """
+        if w.all():
+            return
+
+        index = np.flatnonzero(w)
+        for param in Forest.pixel_attributes:
+            value = getattr(self, param, None)
+            if value is not None:
+                setattr(self, param, value[index])
+
     def cont_fit(self):
         """Computes the forest continuum.
 
@@ -780,14 +1165,13 @@ class Forest(QSO):
         (see equation 2 of du Mas des Bourboux et al. 2020)
         Flags the forest with bad_cont if the computation fails.
         """
-        log_lambda_max = (Forest.log_lambda_max_rest_frame +
-                          np.log10(1 + self.z_qso))
-        log_lambda_min = (Forest.log_lambda_min_rest_frame +
-                          np.log10(1 + self.z_qso))
+        log_one_plus_z_qso = self.log_one_plus_z_qso
+        log_lambda_max = Forest.log_lambda_max_rest_frame + log_one_plus_z_qso
+        log_lambda_min = Forest.log_lambda_min_rest_frame + log_one_plus_z_qso
         # get mean continuum
         try:
             mean_cont = Forest.get_mean_cont(self.log_lambda -
-                                             np.log10(1 + self.z_qso))
+                                             log_one_plus_z_qso)
         except ValueError:
             raise Exception("Problem found when loading get_mean_cont")
 
@@ -800,13 +1184,10 @@ class Forest(QSO):
         if not self.dla_transmission is None:
             mean_cont *= self.dla_transmission
 
-        # pixel variance due to the Large Scale Strucure
-        var_lss = Forest.get_var_lss(self.log_lambda)
-        # correction factor to the contribution of the pipeline
-        # estimate of the instrumental noise to the variance.
-        eta = Forest.get_eta(self.log_lambda)
-        # fudge contribution to the variance
-        fudge = Forest.get_fudge(self.log_lambda)
+        # pixel variance due to the Large Scale Strucure, correction factor
+        # to the contribution of the pipeline estimate of the instrumental
+        # noise to the variance, and fudge contribution to the variance
+        var_lss, eta, fudge = Forest.get_variance_terms(self.log_lambda)
 
         def get_cont_model(p0, p1):
             """Models the flux continuum by multiplying the mean_continuum
@@ -847,42 +1228,52 @@ class Forest(QSO):
             Returns:
                 The obtained chi2
             """
-            cont_model = get_cont_model(p0, p1)
-            var_pipe = 1. / self.ivar / cont_model**2
-            ## prep_del.variance is the variance of delta
-            ## we want here the weights = ivar(flux)
-
-            variance = eta * var_pipe + var_lss + fudge / var_pipe
-            weights = 1.0 / cont_model**2 / variance
-
-            # force weights=1 when use-constant-weight
-            # TODO: make this condition clearer, maybe pass an option
-            # use_constant_weights?
-            if (eta == 0).all():
-                weights = np.ones(len(weights))
-            chi2_contribution = (self.flux - cont_model)**2 * weights
-            return chi2_contribution.sum() - np.log(weights).sum()
-
-        p0 = (self.flux * self.ivar).sum() / self.ivar.sum()
-        p1 = 0.0
-
-        minimizer = iminuit.Minuit(chi2,
-                                   p0=p0,
-                                   p1=p1,
-                                   error_p0=p0 / 2.,
-                                   error_p1=p0 / 2.,
-                                   errordef=1.,
-                                   print_level=0,
-                                   fix_p1=(self.order == 0))
-        minimizer_result, _ = minimizer.migrad()
-
-        self.cont = get_cont_model(minimizer.values["p0"],
-                                   minimizer.values["p1"])
-        self.p0 = minimizer.values["p0"]
-        self.p1 = minimizer.values["p1"]
+            return compute_cont_chi2(p0, p1, log_lambda_shift,
+                                     log_lambda_max - log_lambda_min,
+                                     mean_cont, self.flux, self.ivar, eta,
+                                     var_lss, fudge)
+
+        # distance to the start of the forest, used by the chi2 at every
+        # call of the minimizer
+        log_lambda_shift = self.log_lambda - log_lambda_min
+
+        # with constant weights (eta = 0) the chi2 is a linear least squares
+        # problem in p0 and p1, so its minimum is computed directly
+        if (eta == 0).all():
+            if self.order == 0:
+                p0 = (self.flux * mean_cont).sum() / (mean_cont**2).sum()
+                p1 = 0.0
+            else:
+                x = ((self.log_lambda - log_lambda_min) /
+                     (log_lambda_max - log_lambda_min))
+                design_matrix = np.array([mean_cont, x * mean_cont]).T
+                (p0, p1), _, _, _ = np.linalg.lstsq(design_matrix,
+                                                    self.flux,
+                                                    rcond=None)
+            fit_is_valid = np.isfinite(p0) and np.isfinite(p1)
+        else:
+            p0 = (self.flux * self.ivar).sum() / self.ivar.sum()
+            p1 = 0.0
+
+            minimizer = iminuit.Minuit(chi2,
+                                       p0=p0,
+                                       p1=p1,
+                                       error_p0=p0 / 2.,
+                                       error_p1=p0 / 2.,
+                                       errordef=1.,
+                                       print_level=0,
+                                       fix_p1=(self.order == 0))
+            minimizer_result, _ = minimizer.migrad()
+            p0 = minimizer.values["p0"]
+            p1 = minimizer.values["p1"]
+            fit_is_valid = minimizer_result.is_valid
+
+        self.cont = get_cont_model(p0, p1)
+        self.p0 = p0
+        self.p1 = p1
 
         self.bad_cont = None
-        if not minimizer_result.is_valid:
+        if not fit_is_valid:
             self.bad_cont = "minuit didn't converge"
         if np.any(self.cont <= 0):
             self.bad_cont = "negative continuum"
@@ -1079,7 +1470,8 @@ class Delta(QSO):
             a Delta instance
         """
 
-        cols = line.split()
+        # only split the header fields; the pixel values are parsed at once
+        cols = line.split(None, 11)
         plate = int(cols[0])
         mjd = int(cols[1])
         fiberid = int(cols[2])
@@ -1092,13 +1484,11 @@ class Delta(QSO):
         delta_log_lambda = float(cols[9])
 
         num_pixels = int(cols[10])
-        delta = np.array(cols[11:11 + num_pixels]).astype(float)
-        log_lambda = np.array(cols[11 + num_pixels:11 +
-                                   2 * num_pixels]).astype(float)
-        ivar = np.array(cols[11 + 2 * num_pixels:11 +
-                             3 * num_pixels]).astype(float)
-        exposures_diff = np.array(cols[11 + 3 * num_pixels:11 +
-                                       4 * num_pixels]).astype(float)
+        pixel_values = np.fromstring(cols[11] if len(cols) > 11 else '',
+                                     sep=' ',
+                                     count=4 * num_pixels).reshape(
+                                         4, num_pixels)
+        delta, log_lambda, ivar, exposures_diff = pixel_values
 
         thingid = 0
         order = 0
@@ -1121,30 +1511,40 @@ class Delta(QSO):
             a list of Delta instances
         """
         hdu = fitsio.FITS(file)
-        deltas_image = hdu[0].read().astype(float)
-        ivar_image = hdu[1].read().astype(float)
+        # images are stored with one column per spectrum, transpose them so
+        # that each spectrum is contiguous in memory
+        deltas_image = hdu[0].read().T.astype(float, order='C')
+        ivar_image = hdu[1].read().T.astype(float, order='C')
         log_lambda_image = hdu[2].read().astype(float)
         ra = hdu[3]["RA"][:].astype(np.float64) * np.pi / 180.
         dec = hdu[3]["DEC"][:].astype(np.float64) * np.pi / 180.
         z = hdu[3]["Z"][:].astype(np.float64)
         plate = hdu[3]["PLATE"][:]
         mjd = hdu[3]["MJD"][:]
-        fiberid = hdu[3]["FIBER"]
+        fiberid = hdu[3]["FIBER"][:]
         thingid = hdu[3]["THING_ID"][:]
 
-        nspec = hdu[0].read().shape[1]
+        # select the pixels with positive ivar in all the spectra at once and
+        # split the selection into one (contiguous) array per spectrum
+        w = ivar_image > 0
+        pixel_index = np.nonzero(w)[1]
+        split_index = np.cumsum(w.sum(axis=1))[:-1]
+        deltas_list = np.split(deltas_image[w], split_index)
+        ivar_list = np.split(ivar_image[w], split_index)
+        log_lambda_list = np.split(log_lambda_image[pixel_index], split_index)
+
+        nspec = deltas_image.shape[0]
+        # report progress about 100 times, userprint flushes at every call
+        print_every = max(1, nspec // 100)
         deltas = []
         for index in range(nspec):
-            if index % 100 == 0:
+            if index % print_every == 0:
                 userprint("\rreading deltas {} of {}".format(index, nspec),
                           end="")
 
-            delta = deltas_image[:, index]
-            ivar = ivar_image[:, index]
-            w = ivar > 0
-            delta = delta[w]
-            aux_ivar = ivar[w]
-            log_lambda = log_lambda_image[w]
+            delta = deltas_list[index]
+            aux_ivar = ivar_list[index]
+            log_lambda = log_lambda_list[index]
 
             order = 1
             exposures_diff = None
@@ -1156,7 +1556,7 @@ class Delta(QSO):
             deltas.append(
                 Delta(thingid[index], ra[index], dec[index], z[index],
                       plate[index], mjd[index], fiberid[index], log_lambda,
-                      aux_ivar, None, delta, order, ivar, exposures_diff,
+                      aux_ivar, None, delta, order, aux_ivar, exposures_diff,
                       mean_snr, mean_reso, mean_z, delta_log_lambda))
 
         hdu.close()
@@ -1169,17 +1569,14 @@ class Delta(QSO):
         fitiing. See equations 5 and 6 of du Mas des Bourboux et al. 2020
         """
         # 2nd term in equation 6
-        mean_delta = np.average(self.delta, weights=self.weights)
+        (mean_delta, mean_log_lambda,
+         mean_delta_log_lambda) = compute_projection_stats(
+             self.log_lambda, self.delta, self.weights)
 
         # 3rd term in equation 6
         res = 0
         if (self.order == 1) and self.delta.shape[0] > 1:
-            mean_log_lambda = np.average(self.log_lambda, weights=self.weights)
-            meanless_log_lambda = self.log_lambda - mean_log_lambda
-            mean_delta_log_lambda = (
-                np.sum(self.weights * self.delta * meanless_log_lambda) /
-                np.sum(self.weights * meanless_log_lambda**2))
-            res = mean_delta_log_lambda * meanless_log_lambda
+            res = mean_delta_log_lambda * (self.log_lambda - mean_log_lambda)
         elif self.order == 1:
             res = self.delta
 
@@ -1,13 +1,46 @@
 """This module defines data structure to deal with Damped Lyman-alpha
 Absorbers (DLAs)
 
-This module provides with one class (DLA). See the respective
-docstrings for more details
+This module provides with one class (DLA) and the numba kernel
+compute_voigt_mean used by it. See the respective docstrings for more details
 """
 import numpy as np
+from numba import jit
+
 from picca import constants
 
 
+@jit(nopython=True)
+def compute_voigt_mean(a_voight, u_voight, gaussian_dist):
+    """Averages the Voigt integrand over a set of gaussian draws.
+
+    Equivalent to
+        np.mean(1 / (a_voight**2 + (gaussian_dist[:, None] - u_voight)**2),
+                axis=0)
+    but accumulated pixel by pixel, without building the
+    (gaussian_dist.size, u_voight.size) array.
+
+    Args:
+        a_voight: float
+            Voigt damping parameter.
+        u_voight: array of floats
+            Dimensionless frequency offset in Doppler widths.
+        gaussian_dist: array of floats
+            Gaussian draws (with variance 2) used to sample the integral
+
+    Returns:
+        The mean of the integrand for each element in u_voight
+    """
+    a_voight2 = a_voight**2
+    unnormalized_voigt = np.zeros(u_voight.size)
+    for index in range(u_voight.size):
+        total = 0.
+        for gaussian in gaussian_dist:
+            total += 1 / (a_voight2 + (gaussian - u_voight[index])**2)
+        unnormalized_voigt[index] = total / gaussian_dist.size
+    return unnormalized_voigt
+
+
 class DLA:
     """Class to represent Damped Lyman-alpha Absorbers.
 
@@ -38,10 +71,9 @@ class DLA:
         self.z_abs = z_abs
         self.nhi = nhi
 
-        self.transmission = self.profile_lya_absorption(10**data.log_lambda,
-                                                        z_abs, nhi)
-        self.transmission *= self.profile_lyb_absorption(
-            10**data.log_lambda, z_abs, nhi)
+        lambda_ = 10**data.log_lambda
+        self.transmission = self.profile_lya_absorption(lambda_, z_abs, nhi)
+        self.transmission *= self.profile_lyb_absorption(lambda_, z_abs, nhi)
 
     @staticmethod
     def profile_lya_absorption(lambda_, z_abs, nhi):
@@ -167,6 +199,8 @@ class DLA:
         """
         nun_points = 1000
         gaussian_dist = np.random.normal(size=nun_points) * np.sqrt(2)
-        unnormalized_voigt = np.mean(
-            1 / (a_voight**2 + (gaussian_dist[:, None] - u_voight)**2), axis=0)
+        unnormalized_voigt = compute_voigt_mean(a_voight,
+                                                np.asarray(u_voight,
+                                                           dtype=float),
+                                                gaussian_dist)
         return unnormalized_voigt * a_voight / np.sqrt(np.pi)
@@ -1,6 +1,5 @@
 import astropy.io.fits as pyfits
 import numpy as np
-import scipy as sp
 import scipy.interpolate
 import sys
 
@@ -88,11 +87,11 @@ class model:
             av_dnl = [0.5140, 0.5480, 0.6110, 0.6080, 0.5780]
             bv_dnl = [1.6000, 1.6100, 1.6400, 1.6500, 1.6300]
             kp_dnl = [19.400, 19.500, 21.100, 19.200, 17.100]
-            q1_dnl_interp = sp.interpolate.interp1d(z_dnl, q1_dnl, kind='linear', fill_value=(q1_dnl[0],q1_dnl[-1]), bounds_error=False)
-            kv_dnl_interp = sp.interpolate.interp1d(z_dnl, kv_dnl, kind='linear', fill_value=(kv_dnl[0],kv_dnl[-1]), bounds_error=False)
-            av_dnl_interp = sp.interpolate.interp1d(z_dnl, av_dnl, kind='linear', fill_value=(av_dnl[0],av_dnl[-1]), bounds_error=False)
-            bv_dnl_interp = sp.interpolate.interp1d(z_dnl, bv_dnl, kind='linear', fill_value=(bv_dnl[0],bv_dnl[-1]), bounds_error=False)
-            kp_dnl_interp = sp.interpolate.interp1d(z_dnl, kp_dnl, kind='linear', fill_value=(kp_dnl[0],kp_dnl[-1]), bounds_error=False)
+            q1_dnl_interp = scipy.interpolate.interp1d(z_dnl, q1_dnl, kind='linear', fill_value=(q1_dnl[0],q1_dnl[-1]), bounds_error=False)
+            kv_dnl_interp = scipy.interpolate.interp1d(z_dnl, kv_dnl, kind='linear', fill_value=(kv_dnl[0],kv_dnl[-1]), bounds_error=False)
+            av_dnl_interp = scipy.interpolate.interp1d(z_dnl, av_dnl, kind='linear', fill_value=(av_dnl[0],av_dnl[-1]), bounds_error=False)
+            bv_dnl_interp = scipy.interpolate.interp1d(z_dnl, bv_dnl, kind='linear', fill_value=(bv_dnl[0],bv_dnl[-1]), bounds_error=False)
+            kp_dnl_interp = scipy.interpolate.interp1d(z_dnl, kp_dnl, kind='linear', fill_value=(kp_dnl[0],kp_dnl[-1]), bounds_error=False)
             self.q1_dnl = q1_dnl_interp(self.zref)
             self.kv_dnl = kv_dnl_interp(self.zref)
             self.av_dnl = av_dnl_interp(self.zref)
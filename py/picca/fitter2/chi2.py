@@ -4,7 +4,9 @@ import iminuit
 import time
 import h5py
 import sys
+from collections import OrderedDict
 from scipy.linalg import cholesky
+from scipy.linalg.blas import dtrmm
 
 from picca.utils import userprint
 from . import priors
@@ -58,7 +60,18 @@ class chi2:
         if 'chi2 scan' in dic_init:
             self.dic_chi2scan = dic_init['chi2 scan']
 
+        # last chi2 values, keyed by the parameters they were computed at.
+        # Minuit repeats some evaluations (e.g. at the start of hesse and
+        # minos), this avoids recomputing the models. It must be cleared
+        # whenever the data change (see _minimize)
+        self._chi2_cache = OrderedDict()
+        self._chi2_cache_size = 256
+
     def __call__(self, *pars):
+        if pars in self._chi2_cache:
+            self._chi2_cache.move_to_end(pars)
+            return self._chi2_cache[pars]
+
         dic = {p:pars[i] for i,p in enumerate(self.par_names)}
         dic['SB'] = False
         chi2 = 0
@@ -70,15 +83,20 @@ class chi2:
 
         if self.verbosity == 1:
             del dic['SB']
-            for p in sorted(dic.keys()):
-                userprint(p+" "+str(dic[p]))
-
-            userprint("Chi2: "+str(chi2))
-            userprint("---\n")
+            # one print (and flush) per call instead of one per parameter
+            lines = [p+" "+str(dic[p]) for p in sorted(dic.keys())]
+            lines += ["Chi2: "+str(chi2), "---\n"]
+            userprint("\n".join(lines))
+
+        self._chi2_cache[pars] = chi2
+        if len(self._chi2_cache) > self._chi2_cache_size:
+            self._chi2_cache.popitem(last=False)
         return chi2
 
     def _minimize(self):
         t0 = time.time()
+        # the data may have changed since the last fit (fastMC)
+        self._chi2_cache.clear()
         par_names = [name for d in self.data for name in d.pars_init]
         kwargs = {name:val for d in self.data for name, val in d.pars_init.items()}
         kwargs.update({name:err for d in self.data for name, err in d.par_error.items()})
@@ -115,20 +133,17 @@ class chi2:
             self.best_fit.hesse()
             self.best_fit.print_fmin()
 
+        ## parameters of the peak and of the smooth components
         values = dict(self.best_fit.values)
         values['SB'] = False
+        values_sb = dict(values)
+        values_sb['SB'] = True & (not self.full_shape)
+        values_sb['sigmaNL_par'] = 0.
+        values_sb['sigmaNL_per'] = 0.
+        pk_peak = self.pk_lin-self.pksb_lin
         for d in self.data:
-            d.best_fit_model = values['bao_amp']*d.xi_model(self.k, self.pk_lin-self.pksb_lin, values)
-
-            values['SB'] = True & (not self.full_shape)
-            sigmaNL_par = values['sigmaNL_par']
-            sigmaNL_per = values['sigmaNL_per']
-            values['sigmaNL_par'] = 0.
-            values['sigmaNL_per'] = 0.
-            d.best_fit_model += d.xi_model(self.k, self.pksb_lin, values)
-            values['SB'] = False
-            values['sigmaNL_par'] = sigmaNL_par
-            values['sigmaNL_per'] = sigmaNL_per
+            d.best_fit_model = values['bao_amp']*d.xi_model(self.k, pk_peak, values)
+            d.best_fit_model += d.xi_model(self.k, self.pksb_lin, values_sb)
 
     def chi2scan(self):
         if not hasattr(self, "dic_chi2scan"): return
@@ -138,18 +153,11 @@ class chi2:
         ### Set all parameters to the minimum and store the current state
         store_data_pars = {}
         for d in self.data:
-            store_d_pars_init = {}
-            store_d_par_error = {}
-            store_d_par_fixed = {}
-            for name in d.pars_init.keys():
-                store_d_pars_init[name] = d.pars_init[name]
+            store_data_pars[d.name] = {'init':d.pars_init.copy(), 'error':d.par_error.copy(), 'fixed':d.par_fixed.copy()}
+            for name in d.pars_init:
                 d.pars_init[name] = self.best_fit.values[name]
-            for name in d.par_error.keys():
-                store_d_par_error[name] = d.par_error[name]
+            for name in d.par_error:
                 d.par_error[name] = self.best_fit.errors[name.split('error_')[1]]
-            for name in d.par_fixed.keys():
-                store_d_par_fixed[name] = d.par_fixed[name]
-            store_data_pars[d.name] = {'init':store_d_pars_init, 'error':store_d_par_error, 'fixed':store_d_par_fixed}
 
         ###
         for p in self.dic_chi2scan.keys():
@@ -204,15 +212,9 @@ class chi2:
 
         ### Set all parameters to where they were before
         for d in self.data:
-            store_d_pars_init = store_data_pars[d.name]['init']
-            store_d_par_error = store_data_pars[d.name]['error']
-            store_d_par_fixed = store_data_pars[d.name]['fixed']
-            for name in d.pars_init.keys():
-                d.pars_init[name] = store_d_pars_init[name]
-            for name in d.par_error.keys():
-                d.par_error[name] = store_d_par_error[name]
-            for name in d.par_fixed.keys():
-                d.par_fixed[name] = store_d_par_fixed[name]
+            d.pars_init.update(store_data_pars[d.name]['init'])
+            d.par_error.update(store_data_pars[d.name]['error'])
+            d.par_fixed.update(store_data_pars[d.name]['fixed'])
 
     def fastMC(self):
         if not hasattr(self,"nfast_mc"): return
@@ -235,32 +237,41 @@ class chi2:
                     d.pars_init[p] = self.fidfast_mc[p]
                     d.par_fixed['fix_'+p] = self.fixfast_mc['fix_'+p]
 
-        self.fiducial_values['SB'] = False
+        ## parameters of the peak and of the smooth components
+        fiducial_values = dict(self.fiducial_values)
+        fiducial_values['SB'] = False
+        fiducial_values_sb = dict(fiducial_values)
+        fiducial_values_sb['SB'] = True
+        fiducial_values_sb['sigmaNL_per'] = 0
+        fiducial_values_sb['sigmaNL_par'] = 0
+        pk_peak = self.pk_lin-self.pksb_lin
         for d in self.data:
-            d.fiducial_model = self.fiducial_values['bao_amp']*d.xi_model(self.k, self.pk_lin-self.pksb_lin, self.fiducial_values)
-
-            self.fiducial_values['SB'] = True
-            snl_per = self.fiducial_values['sigmaNL_per']
-            snl_par = self.fiducial_values['sigmaNL_par']
-            self.fiducial_values['sigmaNL_per'] = 0
-            self.fiducial_values['sigmaNL_par'] = 0
-            d.fiducial_model += d.xi_model(self.k, self.pksb_lin, self.fiducial_values)
-            self.fiducial_values['SB'] = False
-            self.fiducial_values['sigmaNL_per'] = snl_per
-            self.fiducial_values['sigmaNL_par'] = snl_par
-        del self.fiducial_values['SB']
+            d.fiducial_model = fiducial_values['bao_amp']*d.xi_model(self.k, pk_peak, fiducial_values)
+            d.fiducial_model += d.xi_model(self.k, self.pksb_lin, fiducial_values_sb)
+
+        # draw all the realizations at once (the random numbers come in the
+        # same order as one draw per iteration and data set) and correlate
+        # them with a single product per data set
+        if not self.forecast_mc:
+            num_points = [len(d.da) for d in self.data]
+            g = np.random.randn(nfast_mc, sum(num_points))
+            # d.cho is upper triangular: use a triangular product
+            fast_mc_da = [
+                dtrmm(1., d.cho, g_d.T).T + d.fiducial_model
+                for d, g_d in zip(
+                    self.data, np.split(g, np.cumsum(num_points)[:-1], axis=1))
+            ]
 
         self.fast_mc = {}
         self.fast_mc['chi2'] = []
         self.fast_mc_data = {}
         for it in range(nfast_mc):
-            for d in self.data:
+            for index, d in enumerate(self.data):
                 # if computing forecast, do not add randomness
                 if self.forecast_mc:
                     d.da = d.fiducial_model
                 else:
-                    g = np.random.randn(len(d.da))
-                    d.da = d.cho.dot(g) + d.fiducial_model
+                    d.da = fast_mc_da[index][it]
                 self.fast_mc_data[d.name+'_'+str(it)] = d.da
                 d.da_cut = d.da[d.mask]
 
@@ -332,16 +343,13 @@ class chi2:
             g = f.create_group(d.name)
             g.attrs['ndata'] = d.mask.sum()
             g.attrs['chi2'] = d.chi2(self.k, self.pk_lin, self.pksb_lin, self.full_shape, values)
-            fit = g.create_dataset("fit", d.da.shape, dtype = "f")
-            fit[...] = d.best_fit_model
+            g.create_dataset("fit", data=d.best_fit_model, dtype="f")
             if not d.bb is None:
                 gbb = g.create_group("broadband")
                 for bbs in d.bb.values():
                     for bb in bbs:
                         tbb = bb(d.r, d.mu, **values)
-                        bband = gbb.create_dataset(bb.name,
-                                tbb.shape, dtype = "f")
-                        bband[...] = tbb
+                        gbb.create_dataset(bb.name, data=tbb, dtype="f")
 
         if hasattr(self, "fast_mc"):
             g = f.create_group("fast mc")
@@ -358,22 +366,17 @@ class chi2:
                     fid.append(p.encode('utf8'))
                 g.attrs['list of fiducial pars'] = fid
                 for d in self.data:
-                    fiducial = g.create_dataset("{}_fiducial".format(d.name), d.da.shape, dtype = "f")
-                    fiducial[...] = d.fiducial_model
+                    g.create_dataset("{}_fiducial".format(d.name),
+                                     data=d.fiducial_model, dtype="f")
             for p in self.fast_mc:
                 vals = np.array(self.fast_mc[p])
                 if p == 'chi2':
-                    d = g.create_dataset("{}".format(p), vals.shape, dtype="f")
-                    d[...] = vals
+                    g.create_dataset("{}".format(p), data=vals, dtype="f")
                 else:
-                    d = g.create_dataset("{}/values".format(p), vals[:,0].shape, dtype="f")
-                    d[...] = vals[:,0]
-                    d = g.create_dataset("{}/errors".format(p), vals[:,1].shape, dtype="f")
-                    d[...] = vals[:,1]
+                    g.create_dataset("{}/values".format(p), data=vals[:,0], dtype="f")
+                    g.create_dataset("{}/errors".format(p), data=vals[:,1], dtype="f")
             for p in self.fast_mc_data:
-                xi = self.fast_mc_data[p]
-                d = g.create_dataset(p, xi.shape, dtype="f")
-                d[...] = xi
+                g.create_dataset(p, data=self.fast_mc_data[p], dtype="f")
 
         ## write down all attributes of parameters minos was run over
         if hasattr(self, "minos_para"):
@@ -399,7 +402,6 @@ class chi2:
             for i,p in enumerate(params):
                 subgrp.attrs[p] = i
             values = self.dic_chi2scan_result['values']
-            vals = subgrp.create_dataset("values", values.shape, dtype = "f")
-            vals[...] = values
+            subgrp.create_dataset("values", data=values, dtype="f")
 
         f.close()
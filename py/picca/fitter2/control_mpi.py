@@ -4,6 +4,7 @@ import sys
 import copy
 from mpi4py import MPI
 from scipy.linalg import cholesky
+from scipy.linalg.blas import dtrmm
 
 from . import sampler, control
 
@@ -79,18 +80,11 @@ class fitter2_mpi(control.fitter2):
         # Set all parameters to the minimum and store the current state
         store_data_pars = {}
         for d in self.chi2.data:
-            store_d_pars_init = {}
-            store_d_par_error = {}
-            store_d_par_fixed = {}
-            for name in d.pars_init.keys():
-                store_d_pars_init[name] = d.pars_init[name]
+            store_data_pars[d.name] = {'init':d.pars_init.copy(), 'error':d.par_error.copy(), 'fixed':d.par_fixed.copy()}
+            for name in d.pars_init:
                 d.pars_init[name] = self.chi2.best_fit.values[name]
-            for name in d.par_error.keys():
-                store_d_par_error[name] = d.par_error[name]
+            for name in d.par_error:
                 d.par_error[name] = self.chi2.best_fit.errors[name.split('error_')[1]]
-            for name in d.par_fixed.keys():
-                store_d_par_fixed[name] = d.par_fixed[name]
-            store_data_pars[d.name] = {'init':store_d_pars_init, 'error':store_d_par_error, 'fixed':store_d_par_fixed}
 
         # Overwrite the run parameters
         for p in self.chi2.dic_chi2scan.keys():
@@ -229,15 +223,9 @@ class fitter2_mpi(control.fitter2):
 
         # Set all parameters to where they were before
         for d in self.chi2.data:
-            store_d_pars_init = store_data_pars[d.name]['init']
-            store_d_par_error = store_data_pars[d.name]['error']
-            store_d_par_fixed = store_data_pars[d.name]['fixed']
-            for name in d.pars_init.keys():
-                d.pars_init[name] = store_d_pars_init[name]
-            for name in d.par_error.keys():
-                d.par_error[name] = store_d_par_error[name]
-            for name in d.par_fixed.keys():
-                d.par_fixed[name] = store_d_par_fixed[name]
+            d.pars_init.update(store_data_pars[d.name]['init'])
+            d.par_error.update(store_data_pars[d.name]['error'])
+            d.par_fixed.update(store_data_pars[d.name]['fixed'])
 
     def _mpi_fastMC(self):
         '''
@@ -302,13 +290,25 @@ class fitter2_mpi(control.fitter2):
 
         # Run parallel fastMC
         # Each CPU writes output once it's done
+        # Draw all the realizations at once (the random numbers come in the
+        # same order as one draw per iteration and data set) and correlate
+        # them with a single product per data set
+        num_points = [len(d.da) for d in self.chi2.data]
+        g = np.random.randn(nfast_mc, sum(num_points))
+        # d.cho is upper triangular: use a triangular product
+        fast_mc_da = [
+            dtrmm(1., d.cho, g_d.T).T + d.fiducial_model
+            for d, g_d in zip(
+                self.chi2.data,
+                np.split(g, np.cumsum(num_points)[:-1], axis=1))
+        ]
+
         self.chi2.fast_mc = {}
         self.chi2.fast_mc['chi2'] = []
         self.chi2.fast_mc_data = {}
         for it in range(nfast_mc):
-            for d in self.chi2.data:
-                g = np.random.randn(len(d.da))
-                d.da = d.cho.dot(g) + d.fiducial_model
+            for index, d in enumerate(self.chi2.data):
+                d.da = fast_mc_da[index][it]
                 self.chi2.fast_mc_data[d.name+'_'+str(it)] = d.da
                 d.da_cut = d.da[d.mask]
 
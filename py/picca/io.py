@@ -20,7 +20,6 @@ import glob
 import sys
 import time
 import os.path
-import copy
 import numpy as np
 import healpy
 import fitsio
@@ -1020,15 +1019,16 @@ def read_from_desi(in_dir, catalog, pk1d=None):
                 w_t = w_t[0]
 
             #-- Loop over three spectrograph arms and coadd fluxes
-            forest = None
+            forests = []
             for spec in spec_data.values():
                 ivar = spec['IV'][w_t].copy()
                 flux = spec['FL'][w_t].copy()
 
                 if not pk1d is None:
-                    reso_sum = spec['RESO'][w_t].copy()
+                    # spectral_resolution_desi only reads three diagonals of
+                    # the resolution matrix, no need to copy it
                     reso_in_km_per_s = spectral_resolution_desi(
-                        reso_sum, spec['log_lambda'])
+                        spec['RESO'][w_t], spec['log_lambda'])
                     exposures_diff = np.zeros(spec['log_lambda'].shape)
                 else:
                     reso_in_km_per_s = None
@@ -1039,12 +1039,9 @@ def read_from_desi(in_dir, catalog, pk1d=None):
                                      entry['Z'], entry[plate_name],
                                      entry[mjd_name], entry[fiberid_name],
                                      exposures_diff, reso_in_km_per_s)
+                forests.append(forest_temp)
 
-                if forest is None:
-                    forest = copy.deepcopy(forest_temp)
-                else:
-                    forest.coadd(forest_temp)
-
+            forest = Forest.coadd_forests(forests) if forests else None
             data.append(forest)
 
     return data
@@ -1175,15 +1172,17 @@ def read_from_minisv_desi(in_dir, catalog, pk1d=None):
                 w_t = w_t[0]
 
             #-- Loop over three spectrograph arms and coadd fluxes
-            forest = None
+            forests = []
             for spec in spec_data.values():
                 ivar = spec['IV'][w_t].copy()
                 flux = spec['FL'][w_t].copy()
 
                 if pk1d is not None:
-                    reso_sum = spec['RESO'][w_t].copy()
+                    # spectral_resolution_desi only reads three diagonals of
+                    # the resolution matrix, no need to copy it
                     reso_in_km_per_s = np.real(
-                        spectral_resolution_desi(reso_sum, spec['log_lambda']))
+                        spectral_resolution_desi(spec['RESO'][w_t],
+                                                 spec['log_lambda']))
                     exposures_diff = np.zeros(spec['log_lambda'].shape)
                 else:
                     reso_in_km_per_s = None
@@ -1194,10 +1193,8 @@ def read_from_minisv_desi(in_dir, catalog, pk1d=None):
                                      entry['DEC'], entry['Z'], entry['TILEID'],
                                      entry['NIGHT'], entry['FIBER'],
                                      exposures_diff, reso_in_km_per_s)
-                if forest is None:
-                    forest = copy.deepcopy(forest_temp)
-                else:
-                    forest.coadd(forest_temp)
+                forests.append(forest_temp)
+            forest = Forest.coadd_forests(forests) if forests else None
 
             if plate_spec not in data:
                 data[plate_spec] = []
@@ -1391,20 +1388,38 @@ def read_objects(filename,
         raise AssertionError()
     userprint("Reading objects ")
 
-    unique_healpix = np.unique(healpixs)
-    for index, healpix in enumerate(unique_healpix):
-        userprint("{} of {}".format(index, len(unique_healpix)))
-        w = healpixs == healpix
+    # compute the derived quantities for the whole catalogue at once and
+    # only then split it into QSO instances
+    columns = [
+        np.asarray(catalog[name])
+        for name in ['THING_ID', 'RA', 'DEC', 'Z', 'PLATE', 'MJD', 'FIBERID']
+    ]
+    z_qso = columns[3].astype(float)
+    weights = ((1. + z_qso) / (1. + z_ref))**(alpha - 1.)
+    if not cosmo is None:
+        r_comov = cosmo.get_r_comov(z_qso)
+        dist_m = cosmo.get_dist_m(z_qso)
+
+    # group the objects by healpix keeping the catalogue order
+    sort_index = np.argsort(healpixs, kind='stable')
+    unique_healpix, start_index = np.unique(healpixs[sort_index],
+                                            return_index=True)
+    end_index = np.append(start_index[1:], sort_index.size)
+    # report progress about 100 times, userprint flushes at every call
+    print_every = max(1, len(unique_healpix) // 100)
+    for index, (healpix, start,
+                end) in enumerate(zip(unique_healpix, start_index, end_index)):
+        if index % print_every == 0:
+            userprint("{} of {}".format(index, len(unique_healpix)))
+        select = sort_index[start:end]
         objs[healpix] = [
-            QSO(entry['THING_ID'], entry['RA'], entry['DEC'], entry['Z'],
-                entry['PLATE'], entry['MJD'], entry['FIBERID'])
-            for entry in catalog[w]
+            QSO(*entry) for entry in zip(*[column[select] for column in columns])
         ]
-        for obj in objs[healpix]:
-            obj.weights = ((1. + obj.z_qso) / (1. + z_ref))**(alpha - 1.)
+        for obj, obj_index in zip(objs[healpix], select):
+            obj.weights = weights[obj_index]
             if not cosmo is None:
-                obj.r_comov = cosmo.get_r_comov(obj.z_qso)
-                obj.dist_m = cosmo.get_dist_m(obj.z_qso)
+                obj.r_comov = r_comov[obj_index]
+                obj.dist_m = dist_m[obj_index]
 
     return objs, catalog['Z'].min()
 
@@ -38,15 +38,19 @@ def compute_mean_cont(data):
     for healpix in sorted(list(data.keys())):
         for forest in data[healpix]:
             bins = ((forest.log_lambda - Forest.log_lambda_min_rest_frame -
-                     np.log10(1 + forest.z_qso)) /
+                     forest.log_one_plus_z_qso) /
                     (Forest.log_lambda_max_rest_frame -
                      Forest.log_lambda_min_rest_frame) * num_bins).astype(int)
             var_lss = Forest.get_var_lss(forest.log_lambda)
             eta = Forest.get_eta(forest.log_lambda)
             fudge = Forest.get_fudge(forest.log_lambda)
-            var_pipe = 1. / forest.ivar / forest.cont**2
-            variance = eta * var_pipe + var_lss + fudge / var_pipe
-            weights = 1 / variance
+            var_pipe = 1. / forest.ivar
+            var_pipe /= forest.cont**2
+            # accumulate in place to avoid allocating temporaries
+            weights = eta * var_pipe
+            weights += var_lss
+            weights += fudge / var_pipe
+            np.reciprocal(weights, out=weights)
             cont = np.bincount(bins,
                                weights=forest.flux / forest.cont * weights)
             mean_cont[:len(cont)] += cont
@@ -306,9 +310,13 @@ def stack(data, stack_from_deltas=False):
                 var_lss = Forest.get_var_lss(forest.log_lambda)
                 eta = Forest.get_eta(forest.log_lambda)
                 fudge = Forest.get_fudge(forest.log_lambda)
-                var = 1. / forest.ivar / forest.cont**2
-                variance = eta * var + var_lss + fudge / var
-                weights = 1. / variance
+                var = 1. / forest.ivar
+                var /= forest.cont**2
+                # accumulate in place to avoid allocating temporaries
+                weights = eta * var
+                weights += var_lss
+                weights += fudge / var
+                np.reciprocal(weights, out=weights)
 
             bins = ((forest.log_lambda - Forest.log_lambda_min) /
                     Forest.delta_log_lambda + 0.5).astype(int)
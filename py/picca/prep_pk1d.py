@@ -138,11 +138,13 @@ def spectral_resolution_desi(reso_matrix, log_lambda):
 
     delta_log_lambda = ((log_lambda[-1] - log_lambda[0]) /
                         float(len(log_lambda) - 1))
-    reso = np.clip(reso_matrix, 1.0e-6, 1.0e6)
-    rms_in_pixel = (np.sqrt(1.0 / 2.0 / np.log(
-        reso[len(reso) // 2][:] / reso[len(reso) // 2 - 1][:])) + np.sqrt(
-            4.0 / 2.0 / np.log(
-                reso[len(reso) // 2][:] / reso[len(reso) // 2 - 2][:]))) / 2.0
+    # only the central diagonal and the two below it are used, so clip just
+    # those rows instead of the full matrix
+    center = len(reso_matrix) // 2
+    reso_minus2, reso_minus1, reso_center = np.clip(
+        reso_matrix[center - 2:center + 1], 1.0e-6, 1.0e6)
+    rms_in_pixel = (np.sqrt(1.0 / 2.0 / np.log(reso_center / reso_minus1)) +
+                    np.sqrt(4.0 / 2.0 / np.log(reso_center / reso_minus2))) / 2.0
 
     reso_in_km_per_s = (rms_in_pixel * SPEED_LIGHT * delta_log_lambda *
                         np.log(10.0))
@@ -0,0 +1,79 @@
+'''
+Test module for picca.co
+'''
+import unittest
+from multiprocessing import Lock, Value
+import numpy as np
+import healpy
+from numba import get_num_threads
+
+from picca import co, constants, utils
+from picca.data import QSO
+
+
+class TestCoThreads(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(42)
+        num_objs = 300
+        cosmo = constants.Cosmo(Om=0.3)
+        ra = random.uniform(0., 0.1, num_objs)
+        dec = random.uniform(0., 0.1, num_objs)
+        z_qso = random.uniform(2., 3., num_objs)
+        r_comov = cosmo.get_r_comov(z_qso)
+        dist_m = cosmo.get_dist_m(z_qso)
+        weights = ((1. + z_qso) / 3.25)**0.44
+
+        co.r_par_min = 0.
+        co.r_par_max = 200.
+        co.r_trans_max = 200.
+        co.z_cut_min = 0.
+        co.z_cut_max = 10.
+        co.num_bins_r_par = 50
+        co.num_bins_r_trans = 50
+        co.nside = 16
+        co.ang_max = utils.compute_ang_max(cosmo, co.r_trans_max,
+                                           z_qso.min())
+        co.type_corr = 'DD'
+        co.x_correlation = False
+        co.objs2 = None
+        co.objs2_arrays = {}
+
+        healpixs = healpy.ang2pix(co.nside, np.pi / 2. - dec, ra)
+        self._objs = {}
+        for index in range(num_objs):
+            obj = QSO(index, ra[index], dec[index], z_qso[index], 0, 0, 0)
+            obj.r_comov = r_comov[index]
+            obj.dist_m = dist_m[index]
+            obj.weights = weights[index]
+            self._objs.setdefault(healpixs[index], []).append(obj)
+        co.num_data = num_objs
+        co.lock = Lock()
+
+        self._num_threads = co.num_threads
+
+    def tearDown(self):
+        co.num_threads = self._num_threads
+
+    def _compute_xi(self, num_threads):
+        co.objs = self._objs
+        co.objs_arrays = {}
+        co.counter = Value('i', 0)
+        co.num_threads = num_threads
+        healpixs = sorted(self._objs)
+        co.fill_neighs(healpixs)
+        return co.compute_xi(healpixs)
+
+    def test_compute_xi_num_threads(self):
+        num_threads = get_num_threads()
+        serial = self._compute_xi(1)
+        parallel = self._compute_xi(4)
+        self.assertEqual(get_num_threads(), num_threads)
+        self.assertTrue(serial[0].sum() > 0.)
+        for serial_array, parallel_array in zip(serial, parallel):
+            self.assertTrue(np.allclose(serial_array, parallel_array))
+        self.assertTrue(np.array_equal(serial[4], parallel[4]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+'''
+Test module for picca.data
+'''
+import unittest
+import numpy as np
+
+from picca.data import (compute_cont_chi2, rebin_ivar_weighted,
+                        compute_projection_stats)
+
+
+class TestDataKernels(unittest.TestCase):
+
+    def setUp(self):
+        self._random = np.random.RandomState(42)
+
+    def test_compute_cont_chi2(self):
+        num_pixels = 200
+        log_lambda_shift = np.linspace(0., 0.1, num_pixels)
+        log_lambda_range = log_lambda_shift[-1]
+        mean_cont = self._random.uniform(0.5, 1.5, num_pixels)
+        flux = self._random.uniform(0.2, 1.2, num_pixels)
+        ivar = self._random.uniform(1., 10., num_pixels)
+        eta = self._random.uniform(0.8, 1.2, num_pixels)
+        var_lss = self._random.uniform(0.01, 0.1, num_pixels)
+        fudge = self._random.uniform(0., 0.01, num_pixels)
+        p0 = 1.1
+        p1 = -0.3
+
+        cont_model = (p1 * log_lambda_shift / log_lambda_range + p0) * mean_cont
+        var_pipe = 1. / ivar / cont_model**2
+        variance = eta * var_pipe + var_lss + fudge / var_pipe
+        weights = 1.0 / cont_model**2 / variance
+        chi2_contribution = (flux - cont_model)**2 * weights
+        expected = chi2_contribution.sum() - np.log(weights).sum()
+
+        chi2 = compute_cont_chi2(p0, p1, log_lambda_shift, log_lambda_range,
+                                 mean_cont, flux, ivar, eta, var_lss, fudge)
+        self.assertTrue(np.allclose(chi2, expected, rtol=1e-12))
+
+    def test_rebin_ivar_weighted(self):
+        num_pixels = 300
+        num_bins = 50
+        bins = np.sort(self._random.randint(0, num_bins - 5, num_pixels))
+        ivar = self._random.uniform(0., 10., num_pixels)
+        flux = self._random.normal(size=num_pixels)
+        reso = self._random.uniform(size=num_pixels)
+        ivar_values = np.array([ivar * flux, ivar * reso])
+
+        rebin_ivar, rebin_values = rebin_ivar_weighted(bins, ivar, ivar_values,
+                                                       num_bins)
+        self.assertTrue(
+            np.allclose(rebin_ivar,
+                        np.bincount(bins, weights=ivar, minlength=num_bins)))
+        for values, rebin_value in zip(ivar_values, rebin_values):
+            self.assertTrue(
+                np.allclose(
+                    rebin_value,
+                    np.bincount(bins, weights=values, minlength=num_bins)))
+
+    def test_compute_projection_stats(self):
+        num_pixels = 150
+        log_lambda = np.linspace(3.55, 3.65, num_pixels)
+        delta = self._random.normal(size=num_pixels)
+        weights = self._random.uniform(0.1, 2., num_pixels)
+
+        expected_mean_delta = np.average(delta, weights=weights)
+        expected_mean_log_lambda = np.average(log_lambda, weights=weights)
+        meanless_log_lambda = log_lambda - expected_mean_log_lambda
+        expected_slope = (np.sum(weights * delta * meanless_log_lambda) /
+                          np.sum(weights * meanless_log_lambda**2))
+
+        mean_delta, mean_log_lambda, slope = compute_projection_stats(
+            log_lambda, delta, weights)
+        self.assertTrue(np.allclose(mean_delta, expected_mean_delta))
+        self.assertTrue(np.allclose(mean_log_lambda, expected_mean_log_lambda))
+        self.assertTrue(np.allclose(slope, expected_slope))
+
+        # a single pixel gives no slope
+        slope = compute_projection_stats(log_lambda[:1], delta[:1],
+                                         weights[:1])[2]
+        self.assertEqual(slope, 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
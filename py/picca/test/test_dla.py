@@ -0,0 +1,29 @@
+'''
+Test module for picca.dla
+'''
+import unittest
+import numpy as np
+
+from picca.dla import compute_voigt_mean
+
+
+class TestDla(unittest.TestCase):
+
+    def setUp(self):
+        self._random = np.random.RandomState(42)
+
+    def test_compute_voigt_mean(self):
+        a_voight = 0.05
+        u_voight = np.linspace(-10., 10., 101)
+        gaussian_dist = self._random.normal(size=1000) * np.sqrt(2)
+
+        expected = np.mean(1 / (a_voight**2 +
+                                (gaussian_dist[:, None] - u_voight)**2),
+                           axis=0)
+        self.assertTrue(
+            np.allclose(compute_voigt_mean(a_voight, u_voight, gaussian_dist),
+                        expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+'''
+Test module for picca.utils
+'''
+import unittest
+import os
+import tempfile
+import shutil
+import numpy as np
+import fitsio
+
+from picca.utils import (fit_wick_missing_correlation, smooth_cov_wick,
+                         update_wick_covariance, DEFAULT_WICK_LENGTH)
+
+
+class TestSmoothCovWick(unittest.TestCase):
+
+    def setUp(self):
+        self._random = np.random.RandomState(42)
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def test_fit_wick_missing_correlation(self):
+        num_bins_r_par = 3
+        num_bins_r_trans = 6
+        index_delta_r_trans = np.arange(num_bins_r_trans, dtype=float)
+        length = np.array([2., 5., 10.])
+        amp = np.array([0.1, -0.05, 0.02])
+        reduced_delta_correlation = np.zeros((num_bins_r_par, num_bins_r_trans))
+        for index_delta_r_par in range(num_bins_r_par):
+            r = (np.sqrt(index_delta_r_trans**2 + index_delta_r_par**2) -
+                 index_delta_r_par)
+            reduced_delta_correlation[index_delta_r_par] = (
+                amp[index_delta_r_par] * np.exp(-r / length[index_delta_r_par]))
+
+        length_fit, amp_fit = fit_wick_missing_correlation(
+            reduced_delta_correlation)
+        self.assertTrue(np.allclose(length_fit, length, rtol=1e-4))
+        self.assertTrue(np.allclose(amp_fit, amp, rtol=1e-4))
+
+    def test_fit_wick_missing_correlation_zero_row(self):
+        reduced_delta_correlation = self._random.normal(scale=0.01,
+                                                        size=(3, 5))
+        reduced_delta_correlation[1] = 0.
+
+        length_fit, amp_fit = fit_wick_missing_correlation(
+            reduced_delta_correlation)
+        self.assertEqual(length_fit[1], DEFAULT_WICK_LENGTH)
+        self.assertEqual(amp_fit[1], 0.)
+        self.assertTrue(np.all(np.isfinite(length_fit)))
+        self.assertTrue(np.all(np.isfinite(amp_fit)))
+
+    def test_fit_wick_missing_correlation_one_trans_bin(self):
+        reduced_delta_correlation = self._random.normal(scale=0.01,
+                                                        size=(4, 1))
+
+        length_fit, amp_fit = fit_wick_missing_correlation(
+            reduced_delta_correlation)
+        self.assertTrue(np.all(length_fit == DEFAULT_WICK_LENGTH))
+        self.assertTrue(np.all(amp_fit == 0.))
+
+    def test_smooth_cov_wick_one_trans_bin(self):
+        num_bins_r_par = 5
+        num_bins_r_trans = 1
+        num_bins = num_bins_r_par * num_bins_r_trans
+        num_subsamples = 50
+        xi = self._random.normal(size=(num_subsamples, num_bins))
+        weights = self._random.uniform(0.5, 1.5, (num_subsamples, num_bins))
+        covariance_wick = np.diag(self._random.uniform(0.5, 1.5, num_bins))
+
+        filename = os.path.join(self._tmp_dir, "cf.fits")
+        results = fitsio.FITS(filename, 'rw', clobber=True)
+        header = [{
+            'name': 'NP',
+            'value': num_bins_r_par
+        }, {
+            'name': 'NT',
+            'value': num_bins_r_trans
+        }]
+        results.write([np.zeros(num_bins)], names=['RP'], header=header)
+        results.write([xi, weights], names=['DA', 'WE'])
+        results.close()
+
+        wick_filename = os.path.join(self._tmp_dir, "wick.fits")
+        results = fitsio.FITS(wick_filename, 'rw', clobber=True)
+        results.write([covariance_wick], names=['CO'])
+        results.close()
+
+        results_filename = os.path.join(self._tmp_dir, "cov.fits")
+        with np.errstate(all='raise'):
+            smooth_cov_wick(filename, wick_filename, results_filename)
+
+        hdul = fitsio.FITS(results_filename)
+        covariance_smooth = hdul[1]['CO'][:]
+        hdul.close()
+        self.assertEqual(covariance_smooth.shape, (num_bins, num_bins))
+        self.assertTrue(np.all(np.isfinite(covariance_smooth)))
+        self.assertTrue(np.allclose(covariance_smooth, covariance_smooth.T))
+
+    def test_update_wick_covariance(self):
+        num_bins_r_par = 4
+        num_bins_r_trans = 3
+        num_bins = num_bins_r_par * num_bins_r_trans
+        index_r_par = np.arange(num_bins) // num_bins_r_trans
+        index_r_trans = np.arange(num_bins) % num_bins_r_trans
+        index_delta_r_trans2d = abs(index_r_trans - index_r_trans[:, None])
+        index_delta_r_par2d = abs(index_r_par - index_r_par[:, None])
+        std = self._random.uniform(0.5, 1.5, num_bins)
+        correlation_wick = self._random.uniform(-0.1, 0.1,
+                                                (num_bins, num_bins))
+        length_fit = self._random.uniform(1., 3., num_bins_r_par)
+        amp_fit = self._random.uniform(0., 0.1, num_bins_r_par)
+        cor0 = self._random.uniform(0., 0.1, num_bins_r_par)
+
+        expected = std * std[:, None]
+        for index in range(num_bins):
+            for index2 in range(index + 1, num_bins):
+                index_delta_r_par = index_delta_r_par2d[index, index2]
+                index_delta_r_trans = index_delta_r_trans2d[index, index2]
+                newcov = correlation_wick[index, index2]
+                if index_delta_r_trans == 0:
+                    newcov += cor0[index_delta_r_par]
+                else:
+                    r = np.sqrt(index_delta_r_trans**2 +
+                                index_delta_r_par**2) - index_delta_r_par
+                    newcov += amp_fit[index_delta_r_par] * np.exp(
+                        -r / length_fit[index_delta_r_par])
+                expected[index, index2] *= newcov
+                expected[index2, index] *= newcov
+
+        covariance_smooth = std * std[:, None]
+        update_wick_covariance(covariance_smooth, correlation_wick,
+                               index_delta_r_par2d, index_delta_r_trans2d,
+                               length_fit, amp_fit, cor0)
+        self.assertTrue(np.allclose(covariance_smooth, expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,16 +5,26 @@ These are:
     - compute_cov
     - smooth_cov
     - smooth_cov_wick
+    - fit_wick_missing_correlation
+    - update_wick_covariance
     - compute_ang_max
     - shuffle_distrib_forests
+    - get_extinction_curve
     - unred
+    - apply_extinction
 See the respective docstrings for more details
 """
 import sys
+import functools
 import numpy as np
 import fitsio
 import scipy.interpolate as interpolate
-import iminuit
+import scipy.optimize as optimize
+from numba import jit
+
+# characteristic length (in bins) of the missing Wick correlation when there
+# is nothing to fit
+DEFAULT_WICK_LENGTH = 5.
 
 
 def userprint(*args, **kwds):
@@ -98,45 +108,35 @@ def smooth_cov(xi,
         userprint('WARNING: returning the unsmoothed covariance')
         return covariance
 
-    correlation = covariance / np.sqrt(var * var[:, None])
-
-    correlation_smooth = np.zeros([num_bins, num_bins])
+    # product of the standard deviations, used to normalise the covariance
+    # and to rescale the smoothed correlation
+    std_product = var * var[:, None]
+    np.sqrt(std_product, out=std_product)
+    correlation = covariance / std_product
 
     # add together the correlation from bins with similar separations in
-    # parallel and perpendicular distances
-    sum_correlation = {}
-    counts_correlation = {}
-    for index in range(num_bins):
-        userprint("\rsmoothing {}".format(index), end="")
-        for index2 in range(index + 1, num_bins):
-            index_delta_r_par = round(
-                abs(r_par[index2] - r_par[index]) / delta_r_par)
-            index_delta_r_trans = round(
-                abs(r_trans[index] - r_trans[index2]) / delta_r_trans)
-            if (index_delta_r_par, index_delta_r_trans) not in sum_correlation:
-                sum_correlation[(index_delta_r_par, index_delta_r_trans)] = 0.
-                counts_correlation[(index_delta_r_par, index_delta_r_trans)] = 0
-
-            sum_correlation[(index_delta_r_par,
-                             index_delta_r_trans)] += correlation[index, index2]
-            counts_correlation[(index_delta_r_par, index_delta_r_trans)] += 1
+    # parallel and perpendicular distances: each pair of bins is labelled by
+    # its rounded separations and the correlations are summed per label
+    index, index2 = np.triu_indices(num_bins, k=1)
+    index_delta_r_par = np.rint(
+        np.abs(r_par[index2] - r_par[index]) / delta_r_par).astype(np.int64)
+    index_delta_r_trans = np.rint(
+        np.abs(r_trans[index] - r_trans[index2]) /
+        delta_r_trans).astype(np.int64)
+    num_labels_trans = int(
+        np.rint((r_trans.max() - r_trans.min()) / delta_r_trans)) + 1
+    labels = index_delta_r_par * num_labels_trans + index_delta_r_trans
+    sum_correlation = np.bincount(labels, weights=correlation[index, index2])
+    counts_correlation = np.bincount(labels)
 
-    for index in range(num_bins):
-        correlation_smooth[index, index] = 1.
-        for index2 in range(index + 1, num_bins):
-            index_delta_r_par = round(
-                abs(r_par[index2] - r_par[index]) / delta_r_par)
-            index_delta_r_trans = round(
-                abs(r_trans[index] - r_trans[index2]) / delta_r_trans)
-            correlation_smooth[index, index2] = (
-                sum_correlation[(index_delta_r_par, index_delta_r_trans)] /
-                counts_correlation[(index_delta_r_par, index_delta_r_trans)])
-            correlation_smooth[index2, index] = correlation_smooth[index,
-                                                                   index2]
+    correlation_smooth = np.zeros([num_bins, num_bins])
+    correlation_smooth[index, index2] = (sum_correlation[labels] /
+                                         counts_correlation[labels])
+    correlation_smooth[index2, index] = correlation_smooth[index, index2]
+    np.fill_diagonal(correlation_smooth, 1.)
 
-    userprint("\n")
-    covariance_smooth = correlation_smooth * np.sqrt(var * var[:, None])
-    return covariance_smooth
+    correlation_smooth *= std_product
+    return correlation_smooth
 
 
 def smooth_cov_wick(filename, wick_filename, results_filename):
@@ -171,7 +171,11 @@ def smooth_cov_wick(filename, wick_filename, results_filename):
         userprint('WARNING: returning')
         return
 
-    correlation = covariance / np.sqrt(var * var[:, None])
+    # product of the standard deviations, used to normalise the covariance
+    # and later as the starting point of the smoothed covariance
+    std_product = var * var[:, None]
+    np.sqrt(std_product, out=std_product)
+    correlation = covariance / std_product
     correlation1d = correlation.reshape(num_bins * num_bins)
 
     # load Wick covariance
@@ -185,7 +189,9 @@ def smooth_cov_wick(filename, wick_filename, results_filename):
         userprint('WARNING: returning')
         return
 
-    correlation_wick = covariance_wick / np.sqrt(var_wick * var_wick[:, None])
+    correlation_wick = var_wick * var_wick[:, None]
+    np.sqrt(correlation_wick, out=correlation_wick)
+    np.divide(covariance_wick, correlation_wick, out=correlation_wick)
     correlation_wick1d = correlation_wick.reshape(num_bins * num_bins)
 
     # difference between 1d correlations
@@ -200,87 +206,141 @@ def smooth_cov_wick(filename, wick_filename, results_filename):
     index_delta_r_trans1d = index_delta_r_trans2d.reshape(num_bins * num_bins)
     index_delta_r_par1d = index_delta_r_par2d.reshape(num_bins * num_bins)
 
-    # compute the reduced correlation
+    # compute the reduced correlation: the pairs of bins separated by
+    # (index_r_par[index], index_r_trans[index]) are labelled by index, so
+    # group the pairs by label once (keeping their order, so that the means
+    # are unchanged) instead of scanning all the pairs for every bin
+    labels = index_delta_r_par1d * num_bins_r_trans + index_delta_r_trans1d
+    sort_index = np.argsort(labels, kind='stable')
+    delta_correlation1d_sorted = delta_correlation1d[sort_index]
+    bounds = np.searchsorted(labels[sort_index], np.arange(num_bins + 1))
     reduced_delta_correlation1d = np.zeros(num_bins)
     for index in range(0, num_bins):
-        userprint("\rsmoothing {}".format(index), end="")
-        reduced_delta_correlation1d[index] = np.mean(delta_correlation1d[
-            (index_delta_r_par1d == index_r_par[index]) &
-            (index_delta_r_trans1d == index_r_trans[index])])
+        reduced_delta_correlation1d[index] = np.mean(
+            delta_correlation1d_sorted[bounds[index]:bounds[index + 1]])
     reduced_delta_correlation = reduced_delta_correlation1d.reshape(
         num_bins_r_par, num_bins_r_trans)
-    userprint("")
 
     #### fit for length and amp at each delta_r_par
-    def corrfun(index_delta_r_par, index_delta_r_trans, length, amp):
-        """Models the missing correlation in the Wick computation
-        with an exponential
+    length_fit, amp_fit = fit_wick_missing_correlation(
+        reduced_delta_correlation)
 
-        Args:
-            index_delta_r_par: int
-                Index associated with the separation in parallel distance
-            index_delta_r_trans: int
-                Index associated with the separation in transverse distance
-            length: float
-                Characteristic length of the exponential
-            amp: float
-                Amplitude of the exponential
+    #### hybrid covariance from wick + fit
+    covariance_smooth = std_product
+
+    cor0 = reduced_delta_correlation1d[index_r_trans == 0]
+    update_wick_covariance(covariance_smooth, correlation_wick,
+                           index_delta_r_par2d, index_delta_r_trans2d,
+                           length_fit, amp_fit, cor0)
+
+    results = fitsio.FITS(results_filename, 'rw', clobber=True)
+    results.write([covariance_smooth], names=['CO'], extname='COR')
+    results.close()
+    userprint(results_filename, ' written')
 
-        Returns:
-            The model with the issed correlation
-        """
-        r = np.sqrt(
-            float(index_delta_r_trans)**2 +
-            float(index_delta_r_par)**2) - float(index_delta_r_par)
-        return amp * np.exp(-r / length)
 
-    def chi2(length, amp, index_delta_r_par):
-        """Computes the chi2 for a given set of parameters in the model
+def fit_wick_missing_correlation(reduced_delta_correlation):
+    """Fits the missing correlation in the Wick computation
+
+    The missing correlation at each parallel separation is modelled as
+    amp * exp(-r / length), with r = sqrt(index_delta_r_trans**2 +
+    index_delta_r_par**2) - index_delta_r_par, and fitted over the non-zero
+    transverse separations. The model is linear in amp, so for a given length
+    the best amp is known in closed form and only length is minimized.
+
+    Parallel separations without missing correlation to fit (a single
+    transverse bin, or a row of zeros) get a zero amplitude and the fixed
+    length DEFAULT_WICK_LENGTH.
+
+    Args:
+        reduced_delta_correlation: 2D array of floats
+            Missing correlation, one row per separation in parallel distance
+            and one column per separation in transverse distance
+
+    Returns:
+        The following variables:
+            length_fit: Characteristic length of the exponential at each
+                parallel separation
+            amp_fit: Amplitude of the exponential at each parallel separation
+    """
+    num_bins_r_par, num_bins_r_trans = reduced_delta_correlation.shape
+    index_delta_r_trans = np.arange(1, num_bins_r_trans, dtype=float)
+
+    def profile_chi2(length, r, reduced_delta_correlation_row):
+        """Computes the chi2 of the model minimized over the amplitude
 
         Args:
             length: float
                 Characteristic length of the exponential
-            amp: float
-                Amplitude of the exponential
-            index_delta_r_par: int
-                Index associated with the separation in parallel distance
+            r: array of floats
+                Distance entering the exponential at each transverse
+                separation
+            reduced_delta_correlation_row: array of floats
+                Missing correlation at each transverse separation
 
         Returns:
-            The chi2 value
+            The chi2 value and the best amplitude
         """
-        chi2 = 0.
-        index_delta_r_par = int(index_delta_r_par)
-        for index_delta_r_trans in range(1, num_bins_r_trans):
-            chi = (reduced_delta_correlation[index_delta_r_par,
-                                             index_delta_r_trans] -
-                   corrfun(index_delta_r_par, index_delta_r_trans, length, amp))
-            chi2 += chi**2
-        chi2 = chi2 * num_bins_r_par * num_bins
-        return chi2
-
-    length_fit = np.zeros(num_bins_r_par)
+        shape = np.exp(-r / length)
+        amp = ((reduced_delta_correlation_row * shape).sum() /
+               (shape**2).sum())
+        chi2 = ((reduced_delta_correlation_row - amp * shape)**2).sum()
+        return chi2, amp
+
+    length_fit = np.full(num_bins_r_par, DEFAULT_WICK_LENGTH)
     amp_fit = np.zeros(num_bins_r_par)
     for index_delta_r_par in range(num_bins_r_par):
-        minimizer = iminuit.Minuit(chi2,
-                                   length=5.,
-                                   error_length=0.2,
-                                   limit_length=(1., 400.),
-                                   amp=1.,
-                                   error_amp=0.2,
-                                   index_delta_r_par=index_delta_r_par,
-                                   fix_index_delta_r_par=True,
-                                   userprint_level=1,
-                                   errordef=1.)
-        minimizer.migrad()
-        length_fit[index_delta_r_par] = minimizer.values['length']
-        amp_fit[index_delta_r_par] = minimizer.values['amp']
+        reduced_delta_correlation_row = reduced_delta_correlation[
+            index_delta_r_par, 1:]
+        # nothing to fit, keep the default values
+        if not np.any(reduced_delta_correlation_row):
+            continue
+        r = (np.sqrt(index_delta_r_trans**2 + float(index_delta_r_par)**2) -
+             float(index_delta_r_par))
+        result = optimize.minimize_scalar(
+            lambda length: profile_chi2(length, r,
+                                        reduced_delta_correlation_row)[0],
+            bounds=(1., 400.),
+            method='bounded')
+        length_fit[index_delta_r_par] = result.x
+        amp_fit[index_delta_r_par] = profile_chi2(
+            result.x, r, reduced_delta_correlation_row)[1]
+
+    return length_fit, amp_fit
+
+
+@jit(nopython=True)
+def update_wick_covariance(covariance_smooth, correlation_wick,
+                           index_delta_r_par2d, index_delta_r_trans2d,
+                           length_fit, amp_fit, cor0):
+    """Multiplies the covariance by the hybrid Wick + fit correlation.
+
+    The missing correlation in the Wick computation is added to the Wick
+    correlation: the measured one for bins at the same transverse
+    distance, and the fitted exponential (see smooth_cov_wick) otherwise.
+    The matrix is updated in place.
 
-    #### hybrid covariance from wick + fit
-    covariance_smooth = np.sqrt(var * var[:, None])
-
-    cor0 = reduced_delta_correlation1d[index_r_trans == 0]
+    Args:
+        covariance_smooth: array of floats
+            Product of the standard deviations of each pair of bins
+        correlation_wick: array of floats
+            Correlation matrix from the Wick covariance
+        index_delta_r_par2d: array of ints
+            Index associated with the separation in parallel distance of each
+            pair of bins
+        index_delta_r_trans2d: array of ints
+            Index associated with the separation in transverse distance of
+            each pair of bins
+        length_fit: array of floats
+            Characteristic length of the exponential at each parallel
+            separation
+        amp_fit: array of floats
+            Amplitude of the exponential at each parallel separation
+        cor0: array of floats
+            Missing correlation at zero transverse separation
+    """
+    num_bins = covariance_smooth.shape[0]
     for index in range(num_bins):
-        userprint("\rupdating {}".format(index), end="")
         for index2 in range(index + 1, num_bins):
             index_delta_r_par = index_delta_r_par2d[index, index2]
             index_delta_r_trans = index_delta_r_trans2d[index, index2]
@@ -288,19 +348,14 @@ def smooth_cov_wick(filename, wick_filename, results_filename):
             if index_delta_r_trans == 0:
                 newcov += cor0[index_delta_r_par]
             else:
-                newcov += corrfun(index_delta_r_par, index_delta_r_trans,
-                                  length_fit[index_delta_r_par],
-                                  amp_fit[index_delta_r_par])
+                r = np.sqrt(
+                    float(index_delta_r_trans)**2 +
+                    float(index_delta_r_par)**2) - float(index_delta_r_par)
+                newcov += amp_fit[index_delta_r_par] * np.exp(
+                    -r / length_fit[index_delta_r_par])
             covariance_smooth[index, index2] *= newcov
             covariance_smooth[index2, index] *= newcov
 
-    userprint("\n")
-
-    results = fitsio.FITS(results_filename, 'rw', clobber=True)
-    results.write([covariance_smooth], names=['CO'], extname='COR')
-    results.close()
-    userprint(results_filename, ' written')
-
 
 def compute_ang_max(cosmo, r_trans_max, z_min, z_min2=None):
     """Computes the maximum anglular separation the correlation should be
@@ -354,42 +409,31 @@ def shuffle_distrib_forests(data, seed):
     userprint(("INFO: Shuffling the forests angular position with seed "
                "{}").format(seed))
 
-    data_info = {}
-    param_list = [
-        'ra', 'dec', 'x_cart', 'y_cart', 'z_cart', 'cos_dec', 'thingid'
-    ]
-    data_info['healpix'] = []
-    for param in param_list:
-        data_info[param] = []
-
-    for healpix, deltas in data.items():
-        for delta in deltas:
-            data_info['healpix'].append(healpix)
-            for param in param_list:
-                data_info[param].append(getattr(delta, param))
+    # gather the angular positions of all the forests once, as tuples
+    deltas_list = [delta for deltas in data.values() for delta in deltas]
+    healpixs = [healpix for healpix, deltas in data.items() for _ in deltas]
+    positions = [(delta.ra, delta.dec, delta.x_cart, delta.y_cart,
+                  delta.z_cart, delta.cos_dec, delta.thingid)
+                 for delta in deltas_list]
 
     np.random.seed(seed)
-    new_index = np.arange(len(data_info['ra']))
+    new_index = np.arange(len(deltas_list))
     np.random.shuffle(new_index)
 
-    index = 0
     data_shuffled = {}
-    for deltas in data.values():
-        for delta in deltas:
-            for param in param_list:
-                setattr(delta, param, data_info[param][new_index[index]])
-            if not data_info['healpix'][new_index[index]] in data_shuffled:
-                data_shuffled[data_info['healpix'][new_index[index]]] = []
-            data_shuffled[data_info['healpix'][new_index[index]]].append(delta)
-            index += 1
+    for delta, index in zip(deltas_list, new_index):
+        (delta.ra, delta.dec, delta.x_cart, delta.y_cart, delta.z_cart,
+         delta.cos_dec, delta.thingid) = positions[index]
+        data_shuffled.setdefault(healpixs[index], []).append(delta)
 
     return data_shuffled
 
 
 # pylint: disable=invalid-name,locally-disabled
 # we keep variable names since this function is adopted from elsewhere
-def unred(wave, ebv, R_V=3.1, LMC2=False, AVGLMC=False):
-    """
+def get_extinction_curve(wave, R_V=3.1, LMC2=False, AVGLMC=False):
+    """Computes the extinction curve A(lambda)/E(B-V) used by unred.
+
     https://github.com/sczesla/PyAstronomy
     in /src/pyasl/asl/unred
     """
@@ -398,6 +442,42 @@ def unred(wave, ebv, R_V=3.1, LMC2=False, AVGLMC=False):
     x = 10000. / wave
     curve = x * 0.
 
+    (c1, c2, c3, c4, x0, gamma,
+     tck) = _get_extinction_parameters(R_V, LMC2, AVGLMC)
+
+    # Compute UV portion of A(lambda)/E(B-V) curve using FM fitting function and
+    # R-dependent coefficients
+    xcutuv = 10000.0 / 2700.0
+    iuv = np.where(x >= xcutuv)[0]
+    iopir = np.where(x < xcutuv)[0]
+    if iuv.size > 0:
+        curve[iuv] = _get_extinction_uv(x[iuv], R_V, c1, c2, c3, c4, x0,
+                                        gamma)
+
+    # Compute optical portion of A(lambda)/E(B-V) curve
+    # using cubic spline anchored in UV, optical, and IR
+    if iopir.size > 0:
+        curve[iopir] = interpolate.splev(x[iopir], tck)
+
+    return curve
+
+
+def _get_extinction_uv(xuv, R_V, c1, c2, c3, c4, x0, gamma):
+    """Computes the UV portion of the extinction curve (FM fitting function)
+    at the inverse wavelengths xuv (in inverse microns)."""
+    yuv = c1 + c2 * xuv
+    yuv = yuv + c3 * xuv**2 / ((xuv**2 - x0**2)**2 + (xuv * gamma)**2)
+    yuv = yuv + c4 * (0.5392 * (np.maximum(xuv, 5.9) - 5.9)**2 + 0.05644 *
+                      (np.maximum(xuv, 5.9) - 5.9)**3)
+    yuv = yuv + R_V
+    return yuv
+
+
+@functools.lru_cache(maxsize=8)
+def _get_extinction_parameters(R_V, LMC2, AVGLMC):
+    """Computes the parameters of the extinction curve that do not depend on
+    the wavelength: the coefficients of the UV fitting function and the
+    optical/IR spline. They are cached since R_V barely ever changes."""
     # Set some standard values:
     x0 = 4.596
     gamma = 0.99
@@ -421,32 +501,10 @@ def unred(wave, ebv, R_V=3.1, LMC2=False, AVGLMC=False):
         c2 = 1.11
         c1 = -1.28
 
-    # Compute UV portion of A(lambda)/E(B-V) curve using FM fitting function and
-    # R-dependent coefficients
-    xcutuv = np.array([10000.0 / 2700.0])
+    # spline points in the UV
     xspluv = 10000.0 / np.array([2700.0, 2600.0])
+    yspluv = _get_extinction_uv(xspluv, R_V, c1, c2, c3, c4, x0, gamma)
 
-    iuv = np.where(x >= xcutuv)[0]
-    N_UV = iuv.size
-    iopir = np.where(x < xcutuv)[0]
-    Nopir = iopir.size
-    if N_UV > 0:
-        xuv = np.concatenate((xspluv, x[iuv]))
-    else:
-        xuv = xspluv
-
-    yuv = c1 + c2 * xuv
-    yuv = yuv + c3 * xuv**2 / ((xuv**2 - x0**2)**2 + (xuv * gamma)**2)
-    yuv = yuv + c4 * (0.5392 * (np.maximum(xuv, 5.9) - 5.9)**2 + 0.05644 *
-                      (np.maximum(xuv, 5.9) - 5.9)**3)
-    yuv = yuv + R_V
-    yspluv = yuv[0:2]  # save spline points
-
-    if N_UV > 0:
-        curve[iuv] = yuv[2::]  # remove spline points
-
-    # Compute optical portion of A(lambda)/E(B-V) curve
-    # using cubic spline anchored in UV, optical, and IR
     xsplopir = np.concatenate(
         ([0], 10000.0 /
          np.array([26500.0, 12200.0, 6000.0, 5470.0, 4670.0, 4110.0])))
@@ -459,15 +517,36 @@ def unred(wave, ebv, R_V=3.1, LMC2=False, AVGLMC=False):
                      -4.45636e-05][::-1], R_V)))
     ysplopir = np.concatenate((ysplir, ysplop))
 
-    if Nopir > 0:
-        tck = interpolate.splrep(np.concatenate((xsplopir, xspluv)),
-                                 np.concatenate((ysplopir, yspluv)),
-                                 s=0)
-        curve[iopir] = interpolate.splev(x[iopir], tck)
+    tck = interpolate.splrep(np.concatenate((xsplopir, xspluv)),
+                             np.concatenate((ysplopir, yspluv)),
+                             s=0)
+    return c1, c2, c3, c4, x0, gamma, tck
 
+
+def unred(wave, ebv, R_V=3.1, LMC2=False, AVGLMC=False):
+    """
+    https://github.com/sczesla/PyAstronomy
+    in /src/pyasl/asl/unred
+    """
+    curve = get_extinction_curve(wave, R_V=R_V, LMC2=LMC2, AVGLMC=AVGLMC)
+    return apply_extinction(curve, ebv)
+
+
+def apply_extinction(curve, ebv):
+    """Computes the dust extinction correction from an extinction curve.
+
+    Args:
+        curve: array of floats
+            Extinction curve A(lambda)/E(B-V), as returned by
+            get_extinction_curve
+        ebv: float
+            Colour excess E(B-V)
+
+    Returns:
+        The correction factor to divide the flux by (see unred)
+    """
     #Now apply extinction correction to input flux vector
-    curve *= ebv
+    curve = curve * ebv
     corr = 1. / (10.**(0.4 * curve))
 
     return corr
-
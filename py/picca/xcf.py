@@ -3,6 +3,8 @@ analysis of two delta fields
 
 This module provides several functions:
     - fill_neighs
+    - get_objs_tree
+    - get_objs_array
     - compute_xi
     - compute_xi_forest_pairs
     - compute_dmat
@@ -14,8 +16,9 @@ This module provides several functions:
     - compute_xi_1d
 See the respective docstrings for more details
 """
+
 import numpy as np
-from healpy import query_disc
+from scipy.spatial import cKDTree
 from numba import jit, int32
 
 from picca import constants
@@ -44,6 +47,8 @@ alpha_abs = None
 
 data = None
 objs = None
+# k-d tree on the objects positions, see get_objs_tree
+objs_tree = None
 
 reject = None
 lock = None
@@ -61,39 +66,96 @@ xi_wick = None
 def fill_neighs(healpixs):
     """Create and store a list of neighbours for each of the healpix.
 
-    Neighbours are added to the delta objects directly
+    Neighbours are added to the delta objects directly. Their positions in
+    the objs_list returned by get_objs_tree are also stored, so that their
+    properties can be read from the arrays given by get_objs_array.
 
     Args:
         healpixs: array of ints
             List of healpix numbers
     """
+    tree, objs_list = get_objs_tree()
+    thingid = get_objs_array('thingid')
+    x_cart = get_objs_array('x_cart')
+    y_cart = get_objs_array('y_cart')
+    z_cart = get_objs_array('z_cart')
+    ra = get_objs_array('ra')
+    dec = get_objs_array('dec')
+    z_qso = get_objs_array('z_qso').astype(float)
+    if not ang_correlation:
+        r_comov = get_objs_array('r_comov')
+    # chord length subtended by ang_max, slightly enlarged so that the tree
+    # search never misses a neighbour. Extra neighbours are removed by the cut
+    # in ang below
+    chord_max = 2. * np.sin(min(ang_max * (1. + 1e-6), np.pi) / 2.)
     for healpix in healpixs:
         for delta in data[healpix]:
-            healpix_neighbours = query_disc(
-                nside, [delta.x_cart, delta.y_cart, delta.z_cart],
-                ang_max,
-                inclusive=True)
-            healpix_neighbours = [
-                other_healpix for other_healpix in healpix_neighbours
-                if other_healpix in objs
-            ]
-            neighbours = [
-                obj for other_healpix in healpix_neighbours
-                for obj in objs[other_healpix] if obj.thingid != delta.thingid
-            ]
-            ang = delta.get_angle_between(neighbours)
+            index = np.array(tree.query_ball_point(
+                [delta.x_cart, delta.y_cart, delta.z_cart],
+                chord_max,
+                return_sorted=True),
+                             dtype=np.int64)
+            index = index[thingid[index] != delta.thingid]
+            ang = delta.get_angle_between_arrays(x_cart[index],
+                                                 y_cart[index],
+                                                 z_cart[index], ra[index],
+                                                 dec[index])
             w = ang < ang_max
             if not ang_correlation:
-                r_comov = np.array([obj.r_comov for obj in neighbours])
-                w &= (delta.r_comov[0] - r_comov) * np.cos(ang / 2.) < r_par_max
-                w &= (delta.r_comov[-1] - r_comov) * np.cos(
-                    ang / 2.) > r_par_min
-            neighbours = np.array(neighbours)[w]
-            delta.neighbours = np.array([
-                obj for obj in neighbours
-                if ((delta.z[-1] + obj.z_qso) / 2. >= z_cut_min and
-                    (delta.z[-1] + obj.z_qso) / 2. < z_cut_max)
-            ])
+                w &= ((delta.r_comov[0] - r_comov[index]) * np.cos(ang / 2.) <
+                      r_par_max)
+                w &= ((delta.r_comov[-1] - r_comov[index]) * np.cos(ang / 2.)
+                      > r_par_min)
+            mean_z = (delta.z[-1] + z_qso[index]) / 2.
+            w &= (mean_z >= z_cut_min) & (mean_z < z_cut_max)
+            delta.neighbours_index = index[w]
+            delta.neighbours = np.array(
+                [objs_list[obj_index] for obj_index in delta.neighbours_index])
+
+
+def get_objs_tree():
+    """Gets a k-d tree on the cartesian unit vectors of the objects.
+
+    The tree is built the first time it is requested for the current objs and
+    kept in objs_tree for later calls. Objects are ordered by healpix number,
+    so that the neighbours are found in the same order as with a per-healpix
+    search.
+
+    Returns:
+        The following variables:
+            tree: scipy.spatial.cKDTree on the positions of the objects
+            objs_list: List of the objects, in the order of the tree
+    """
+    global objs_tree
+    if objs_tree is None or objs_tree[0] is not objs:
+        objs_list = [obj for healpix in sorted(objs) for obj in objs[healpix]]
+        positions = np.array([[obj.x_cart, obj.y_cart, obj.z_cart]
+                              for obj in objs_list],
+                             dtype=float).reshape(-1, 3)
+        objs_tree = (objs, cKDTree(positions), objs_list, {})
+    return objs_tree[1], objs_tree[2]
+
+
+def get_objs_array(name):
+    """Gets an attribute of all the objects as an array.
+
+    The array follows the order of the objs_list returned by get_objs_tree. It
+    is built the first time it is requested and kept in objs_tree for later
+    calls.
+
+    Args:
+        name: str
+            Name of the attribute
+
+    Returns:
+        An array with the attribute of each of the objects
+    """
+    _, objs_list = get_objs_tree()
+    objs_arrays = objs_tree[3]
+    if name not in objs_arrays:
+        objs_arrays[name] = np.array(
+            [getattr(obj, name) for obj in objs_list])
+    return objs_arrays[name]
 
 
 def compute_xi(healpixs):
@@ -128,13 +190,17 @@ def compute_xi(healpixs):
                 counter.value += 1
 
             if delta.neighbours.size != 0:
-                ang = delta.get_angle_between(delta.neighbours)
-                z_qso = np.array([obj.z_qso for obj in delta.neighbours])
-                weights_qso = np.array(
-                    [obj.weights for obj in delta.neighbours])
+                index = delta.neighbours_index
+                ang = delta.get_angle_between_arrays(
+                    get_objs_array('x_cart')[index],
+                    get_objs_array('y_cart')[index],
+                    get_objs_array('z_cart')[index],
+                    get_objs_array('ra')[index],
+                    get_objs_array('dec')[index])
+                z_qso = get_objs_array('z_qso')[index]
+                weights_qso = get_objs_array('weights')[index]
                 if ang_correlation:
-                    lambda_qso = np.array(
-                        [10.**obj.log_lambda for obj in delta.neighbours])
+                    lambda_qso = 10.**get_objs_array('log_lambda')[index]
                     compute_xi_forest_pairs_fast(delta.z, 10.**delta.log_lambda,
                                                  10.**delta.log_lambda,
                                                  delta.weights, delta.delta,
@@ -142,10 +208,8 @@ def compute_xi(healpixs):
                                                  weights_qso, ang, weights, xi,
                                                  r_par, r_trans, z, num_pairs)
                 else:
-                    r_comov_qso = np.array(
-                        [obj.r_comov for obj in delta.neighbours])
-                    dist_m_qso = np.array(
-                        [obj.dist_m for obj in delta.neighbours])
+                    r_comov_qso = get_objs_array('r_comov')[index]
+                    dist_m_qso = get_objs_array('dist_m')[index]
                     compute_xi_forest_pairs_fast(delta.z, delta.r_comov,
                                                  delta.dist_m, delta.weights,
                                                  delta.delta, z_qso,
@@ -162,6 +226,7 @@ def compute_xi(healpixs):
                 #z[:len(rebin_z)] += rebin_z
                 #num_pairs[:len(rebin_num_pairs)] += rebin_num_pairs.astype(int)
             setattr(delta, "neighbours", None)
+            setattr(delta, "neighbours_index", None)
 
     w = weights > 0
     xi[w] /= weights[w]
@@ -375,18 +440,24 @@ def compute_dmat(healpixs):
                 continue
             num_pairs += len(delta1.neighbours)
             num_pairs_used += w.sum()
-            neighbours = delta1.neighbours[w]
-            ang = delta1.get_angle_between(neighbours)
-            r_comov2 = np.array([obj.r_comov for obj in neighbours])
-            dist_m2 = np.array([obj.dist_m for obj in neighbours])
-            weights2 = np.array([obj.weights for obj in neighbours])
-            z2 = np.array([obj.z_qso for obj in neighbours])
+            index = delta1.neighbours_index[w]
+            ang = delta1.get_angle_between_arrays(
+                get_objs_array('x_cart')[index],
+                get_objs_array('y_cart')[index],
+                get_objs_array('z_cart')[index],
+                get_objs_array('ra')[index],
+                get_objs_array('dec')[index])
+            r_comov2 = get_objs_array('r_comov')[index]
+            dist_m2 = get_objs_array('dist_m')[index]
+            weights2 = get_objs_array('weights')[index]
+            z2 = get_objs_array('z_qso')[index]
             compute_dmat_forest_pairs_fast(log_lambda1, r_comov1, dist_m1, z1,
                                            weights1, r_comov2, dist_m2, z2,
                                            weights2, ang, weights_dmat, dmat,
                                            r_par_eff, r_trans_eff, z_eff,
                                            weight_eff, order1)
             setattr(delta1, "neighbours", None)
+            setattr(delta1, "neighbours_index", None)
 
     dmat = dmat.reshape(num_bins_r_par * num_bins_r_trans,
                         num_model_bins_r_par * num_model_bins_r_trans)